@@ -103,5 +103,13 @@ def create_app():
             db.session.add(admin_user)
             db.session.commit()
 
+    from app.jobs import job_queue
+    from app.market_poller import start_market_poller
+    from app.order_book import start_order_matcher
+
+    job_queue.start(app)
+    start_order_matcher(app)
+    start_market_poller(app)
+
     return app
 
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def resample(columns: dict, step: int) -> dict:
+    """
+    Aggregates time-ordered candle columns into `step`-second buckets aligned to the
+    epoch (so 1h bars start on the hour and 1d bars at 00:00 UTC).
+
+    open/close come from the first/last bar of each bucket, high/low/volume are reduced
+    over the bucket; every field is computed with one reduceat pass.
+    """
+    times = columns["time"]
+    if len(times) == 0:
+        return columns
+
+    buckets = times - times % step
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.concatenate((starts[1:], [len(times)])) - 1
+
+    return {
+        "time": buckets[starts],
+        "open": columns["open"][starts],
+        "high": np.maximum.reduceat(columns["high"], starts),
+        "low": np.minimum.reduceat(columns["low"], starts),
+        "close": columns["close"][ends],
+        "volume": np.add.reduceat(columns["volume"], starts),
+    }
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: picks `threshold` point indices that keep the visual
+    shape of the (x, y) series. The first and last points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket is the third triangle vertex
+        next_lo, next_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+
+        areas = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(columns: dict, max_points: int) -> dict:
+    """
+    Caps the number of bars to `max_points` using LTTB on the close series.
+    """
+    if len(columns["time"]) <= max_points:
+        return columns
+    keep = lttb_indices(columns["time"], columns["close"], max_points)
+    return {name: values[keep] for name, values in columns.items()}
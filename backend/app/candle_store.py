@@ -0,0 +1,236 @@
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import yfinance as yf
+from sqlalchemy import delete, func, insert
+
+from app import db
+from app.models import Candle
+
+
+INTERVAL_SECONDS = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "1d": 86400,
+}
+
+COLUMNS = ("time", "open", "high", "low", "close", "volume")
+
+# History pulled the first time a (symbol, interval) series is seen
+INITIAL_PERIOD = {
+    "1m": "5d",
+    "5m": "1mo",
+    "1d": "6mo",
+}
+
+# How far back (seconds) Yahoo serves intraday bars to a start/end request; a series that
+# fell further behind resumes from the oldest bar still available
+INTRADAY_WINDOW = {
+    "1m": 7 * 86400,
+    "5m": 59 * 86400,
+    "15m": 59 * 86400,
+    "1h": 729 * 86400,
+}
+
+# Wall-clock time of the last upstream fetch per (symbol, interval), to throttle refreshes
+_last_refresh = {}
+
+
+def last_timestamp(symbol: str, interval: str):
+    return (
+        db.session.query(func.max(Candle.ts))
+        .filter(Candle.symbol == symbol, Candle.interval == interval)
+        .scalar()
+    )
+
+
+def first_bar(symbol: str, interval: str):
+    """
+    (ts, open, bar count) of the oldest stored bar, or None for an empty series.
+    """
+    row = (
+        db.session.query(Candle.ts, Candle.open)
+        .filter(Candle.symbol == symbol, Candle.interval == interval)
+        .order_by(Candle.ts)
+        .first()
+    )
+    if row is None:
+        return None
+    count = db.session.query(func.count(Candle.id)).filter(Candle.symbol == symbol, Candle.interval == interval).scalar()
+    return row.ts, row.open, count
+
+
+def append_frame(symbol: str, interval: str, df) -> int:
+    """
+    Stores the bars of a yfinance OHLCV frame. Bars at or after the first timestamp
+    in the frame are replaced, so a still-forming last bar gets updated in place.
+    Returns the number of bars written.
+    """
+    if df is None or df.empty:
+        return 0
+
+    # Epoch seconds straight from the datetime64[ns] index, OHLCV as one float matrix
+    ts = (df.index.asi8 // 1_000_000_000).tolist()
+    values = df[["Open", "High", "Low", "Close", "Volume"]].fillna(0.0).to_numpy(dtype=np.float64).tolist()
+    rows = [
+        {
+            "symbol": symbol,
+            "interval": interval,
+            "ts": bar_ts,
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": volume,
+        }
+        for bar_ts, (open_, high, low, close, volume) in zip(ts, values)
+    ]
+    return write_rows(symbol, interval, rows)
+
+
+def write_rows(symbol: str, interval: str, rows: list[dict]) -> int:
+    if not rows:
+        return 0
+    db.session.execute(
+        delete(Candle).where(
+            Candle.symbol == symbol,
+            Candle.interval == interval,
+            Candle.ts >= rows[0]["ts"],
+        )
+    )
+    db.session.execute(insert(Candle), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def insert_rows(rows: list[dict]) -> int:
+    """
+    Stores bars that do not overlap the stored series (e.g. a backfill before its first
+    bar); unlike write_rows nothing is replaced.
+    """
+    if not rows:
+        return 0
+    db.session.execute(insert(Candle), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def record_tick(symbol: str, price: float, ts: float | None = None, interval: str = "1m") -> None:
+    """
+    Folds a single trade price into the bar containing `ts` (default: now), creating
+    that bar if needed. Used for series that are built from live quotes.
+    """
+    step = INTERVAL_SECONDS[interval]
+    ts = int(ts if ts is not None else time.time())
+    bar_ts = ts - ts % step
+
+    bar = Candle.query.filter_by(symbol=symbol, interval=interval, ts=bar_ts).first()
+    if bar:
+        bar.high = max(bar.high, price)
+        bar.low = min(bar.low, price)
+        bar.close = price
+    else:
+        previous = (
+            Candle.query.filter(Candle.symbol == symbol, Candle.interval == interval, Candle.ts < bar_ts)
+            .order_by(Candle.ts.desc())
+            .first()
+        )
+        open_ = previous.close if previous else price
+        db.session.add(
+            Candle(
+                symbol=symbol,
+                interval=interval,
+                ts=bar_ts,
+                open=open_,
+                high=max(open_, price),
+                low=min(open_, price),
+                close=price,
+                volume=0.0,
+            )
+        )
+    db.session.commit()
+
+
+def refresh(symbol: str, interval: str = "1m") -> int:
+    """
+    Fetches only the bars newer than the last stored one (re-fetching that last bar,
+    which may still have been forming). The first call loads INITIAL_PERIOD of history.
+    The start is clamped to INTRADAY_WINDOW, so a series that fell further behind leaves
+    a gap instead of asking for a range the provider refuses.
+    """
+    _last_refresh[(symbol, interval)] = time.time()
+    ticker = yf.Ticker(symbol)
+    last_ts = last_timestamp(symbol, interval)
+    if last_ts is None:
+        df = ticker.history(period=INITIAL_PERIOD.get(interval, "1mo"), interval=interval, auto_adjust=True)
+    else:
+        window = INTRADAY_WINDOW.get(interval)
+        if window is not None:
+            last_ts = max(last_ts, int(time.time()) - window)
+        start = datetime.fromtimestamp(last_ts, tz=timezone.utc)
+        df = ticker.history(start=start, interval=interval, auto_adjust=True)
+        df = df[df.index >= start]
+    return append_frame(symbol, interval, df)
+
+
+def refresh_if_due(symbol: str, interval: str = "1m") -> int:
+    last = _last_refresh.get((symbol, interval), 0.0)
+    if time.time() - last < INTERVAL_SECONDS[interval]:
+        return 0
+    return refresh(symbol, interval)
+
+
+def get_columns(symbol: str, interval: str, start: int | None = None, end: int | None = None) -> dict:
+    """
+    Stored bars in [start, end], ordered by time, as one NumPy array per field:
+    {"time": int64[n], "open": float64[n], "high": ..., "low": ..., "close": ..., "volume": ...}
+    """
+    query = db.session.query(
+        Candle.ts, Candle.open, Candle.high, Candle.low, Candle.close, Candle.volume
+    ).filter(Candle.symbol == symbol, Candle.interval == interval)
+    if start is not None:
+        query = query.filter(Candle.ts >= start)
+    if end is not None:
+        query = query.filter(Candle.ts <= end)
+
+    matrix = np.array(query.order_by(Candle.ts).all(), dtype=np.float64).reshape(-1, len(COLUMNS))
+    columns = {name: matrix[:, i] for i, name in enumerate(COLUMNS)}
+    columns["time"] = columns["time"].astype(np.int64)
+    return columns
+
+
+def to_payload(columns: dict, fmt: str = "rows"):
+    """
+    Serializes candle columns for the chart API.
+
+    "rows" (default) is the list of {"time", "open", "high", "low", "close"} objects the
+    frontend chart consumes; "columnar" is {"time": [...], "open": [...], ...}, which is
+    several times smaller and faster to encode for long ranges.
+    """
+    lists = {name: columns[name].tolist() for name in ("time", "open", "high", "low", "close")}
+    if fmt == "columnar":
+        return lists
+    keys = tuple(lists)
+    return [dict(zip(keys, values)) for values in zip(*lists.values())]
+
+
+def refresh_stored_symbols(poller) -> None:
+    """
+    Poller job: appends new 1m bars for every symbol that already has a stored series.
+    """
+    from app.routes.market import MOROCCAN_SYMBOLS
+
+    symbols = [
+        row[0]
+        for row in db.session.query(Candle.symbol).filter(Candle.interval == "1m").distinct()
+        if row[0] not in MOROCCAN_SYMBOLS
+    ]
+    for symbol in symbols:
+        try:
+            refresh(symbol, "1m")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Candle refresh failed for {symbol}: {e}")
@@ -1,11 +1,13 @@
+import threading
 from datetime import datetime, timezone
 
+import numpy as np
 from flask import Blueprint
-from sqlalchemy import event
-from sqlalchemy.orm import object_session
+from sqlalchemy import and_, case, event, func, literal, select
+from sqlalchemy.orm import Session, object_session
 
-from app import db
-from app.models import Challenge, Trade
+from app import db, rule_sets
+from app.models import Challenge, DailyEquitySnapshot, Trade
 
 
 class ChallengeAccount(db.Model):
@@ -22,91 +24,217 @@ challenge_engine_bp = Blueprint("challenge_engine", __name__)
 
 
 VIRTUAL_START_BALANCE = 5000.0
-DAILY_MAX_LOSS_PCT = 5.0
-TOTAL_MAX_LOSS_PCT = 5.0
-PROFIT_TARGET_PCT = 10.0
-
-
-def _get_or_create_account(session, user_id: int) -> ChallengeAccount:
-    account = session.query(ChallengeAccount).filter_by(user_id=user_id).first()
-    if not account:
-        account = ChallengeAccount(
-            user_id=user_id,
-            starting_equity=VIRTUAL_START_BALANCE,
-            current_equity=VIRTUAL_START_BALANCE,
-            status="ACTIVE",
-        )
-        session.add(account)
-        # session.flush() removed to avoid InvalidRequestError during event handling
-    return account
-
-
-def _evaluate_account_for_user(session, user_id: int) -> None:
-    # 1. Get the main Challenge record (Source of Truth for Equity)
-    challenge = (
-        session.query(Challenge)
-        .filter(Challenge.user_id == user_id)
-        .order_by(Challenge.created_at.desc())
-        .first()
-    )
-    
-    if not challenge:
-        return
-
-    # 2. Get the legacy account for status tracking compatibility
-    account = _get_or_create_account(session, user_id)
-    
-    starting = challenge.starting_balance
-    current_equity = challenge.current_equity
-
-    # 3. Calculate Daily PnL (Realized Only - limitation of no daily snapshot in DB)
-    now = datetime.now(timezone.utc)
-    start = datetime(year=now.year, month=now.month, day=now.day, tzinfo=timezone.utc)
-
-    today_trades = (
-        session.query(Trade)
-        .join(Challenge, Trade.challenge_id == Challenge.id)
-        .filter(Challenge.user_id == user_id, Trade.created_at >= start, Trade.created_at <= now)
-        .all()
-    )
-    today_realized_pnl = sum(t.pnl for t in today_trades)
-    
-    # NOTE: Daily Loss here only tracks Realized Loss because we don't have 'start_of_day_equity' in DB.
-    # To fully implement "Daily Equity Drawdown", we would need a new column or table.
-    # We proceed with Realized Daily Loss + Total Equity Loss.
-
-    daily_loss_pct = abs(min(today_realized_pnl, 0.0)) / starting * 100.0 if today_realized_pnl < 0 else 0.0
-    
-    # Total Loss is based on Current Equity (Realized + Unrealized)
-    total_loss_pct = max(0.0, (starting - current_equity)) / starting * 100.0
-    
-    # Profit Target is based on Current Equity
-    profit_pct = max(0.0, (current_equity - starting)) / starting * 100.0
-
-    # 4. Determine Status
-    new_status = "ACTIVE"
-    if daily_loss_pct >= DAILY_MAX_LOSS_PCT:
-        new_status = "FAILED"
-    elif total_loss_pct >= TOTAL_MAX_LOSS_PCT:
-        new_status = "FAILED"
-    elif profit_pct >= PROFIT_TARGET_PCT:
-        new_status = "SUCCESSFUL"
-    
-    # 5. Update Status if changed (and not already final)
-    if challenge.status == "ACTIVE":
-        if new_status != "ACTIVE":
-            challenge.status = new_status
-            account.status = new_status
-            session.add(challenge)
-            session.add(account)
-            # session.commit() # Caller handles commit usually, but if called from event, be careful.
+UPDATE_CHUNK = 5000  # ids per bulk status UPDATE
+
+
+# session.info key collecting the challenges that received trades in the open transaction
+PENDING_RULES_KEY = "challenge_rules_pending"
+
+_rule_backlog = set()
+_rule_backlog_lock = threading.Lock()
+_rule_drain_scheduled = False  # a drain job is queued or running; guarded by _rule_backlog_lock
 
 
 @event.listens_for(Trade, "after_insert")
 def _after_trade_insert(mapper, connection, target) -> None:
-    session = object_session(target) or db.session
-    challenge = session.query(Challenge).filter_by(id=target.challenge_id).first()
-    if not challenge:
-        return
-    _evaluate_account_for_user(session, challenge.user_id)
-
+    # Only note the challenge: the rules run after commit, off the order path
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_RULES_KEY, set()).add(target.challenge_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _schedule_rules_after_commit(session) -> None:
+    challenge_ids = session.info.pop(PENDING_RULES_KEY, None)
+    if challenge_ids:
+        schedule_rule_evaluation(challenge_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rules_after_rollback(session) -> None:
+    session.info.pop(PENDING_RULES_KEY, None)
+
+
+def schedule_rule_evaluation(challenge_ids) -> None:
+    """
+    Queues challenges for rule evaluation on the job queue. Challenges queued while an
+    evaluation is pending or running are folded into it, so a burst of trades on one
+    challenge costs one evaluation. Without job workers (scripts) nothing is scheduled
+    and the periodic challenge-rules sweep picks the challenges up.
+
+    Whether a drain is scheduled is decided under the backlog lock, in the same critical
+    section where the drain decides to stop, so no challenge is left behind in between.
+    """
+    global _rule_drain_scheduled
+    from app.jobs import job_queue
+
+    with _rule_backlog_lock:
+        _rule_backlog.update(challenge_ids)
+        start = not _rule_drain_scheduled and job_queue.is_running()
+        if start:
+            _rule_drain_scheduled = True
+    if start:
+        job_queue.enqueue(_drain_rule_backlog)
+
+
+def _drain_rule_backlog() -> None:
+    global _rule_drain_scheduled
+    while True:
+        with _rule_backlog_lock:
+            challenge_ids = list(_rule_backlog)
+            _rule_backlog.clear()
+            if not challenge_ids:
+                _rule_drain_scheduled = False
+                return
+        try:
+            evaluate_challenges(db.session, challenge_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Put them back for the job's retry; new trades may schedule a drain meanwhile
+            with _rule_backlog_lock:
+                _rule_backlog.update(challenge_ids)
+                _rule_drain_scheduled = False
+            raise
+
+
+def evaluate_challenges(session, challenge_ids=None) -> dict:
+    """
+    Bulk rule evaluation for every ACTIVE challenge (or the given ids).
+
+    One query loads each challenge's equity, thresholds and rule inputs (all kept on the
+    challenge row, no trade scan); each plan's compiled rule set (app.rule_sets) runs as
+    array operations over its rows; transitions are applied with one UPDATE per
+    resulting status, guarded on status = 'ACTIVE'. The caller commits.
+    Returns {"evaluated": n, "FAILED": [...ids], "SUCCESSFUL": [...ids]}.
+    """
+    columns = [
+        Challenge.id,
+        Challenge.user_id,
+        Challenge.plan_name,
+        Challenge.starting_balance,
+        Challenge.current_equity,
+        func.coalesce(Challenge.yesterday_equity, Challenge.starting_balance),
+        Challenge.profit_target,
+        Challenge.max_daily_loss_pct,
+        Challenge.max_total_loss_pct,
+        func.coalesce(Challenge.trading_days, 0),
+        func.coalesce(Challenge.best_day_pnl, 0.0),
+        func.coalesce(Challenge.equity_high_water_mark, Challenge.starting_balance),
+    ]
+
+    query = session.query(*columns).filter(Challenge.status == "ACTIVE")
+    if challenge_ids is not None:
+        challenge_ids = list(challenge_ids)
+        if not challenge_ids:
+            return {"evaluated": 0, "FAILED": [], "SUCCESSFUL": []}
+        query = query.filter(Challenge.id.in_(challenge_ids))
+    rows = query.all()
+
+    result = {"evaluated": len(rows), "FAILED": [], "SUCCESSFUL": []}
+    if not rows:
+        return result
+
+    (ids, user_ids, plans, starting, equity, day_start, profit_target, daily_limit,
+     total_limit, trading_days, best_day, peak) = (np.array(column) for column in zip(*rows))
+    outcomes = rule_sets.evaluate(plans, {
+        "starting": starting.astype(float),
+        "equity": equity.astype(float),
+        "day_start": day_start.astype(float),
+        "peak_equity": peak.astype(float),
+        "profit_target_pct": profit_target.astype(float),
+        "max_daily_loss_pct": daily_limit.astype(float),
+        "max_total_loss_pct": total_limit.astype(float),
+        "trading_days": trading_days.astype(int),
+        "best_day_pnl": best_day.astype(float),
+    })
+
+    for status in ("FAILED", "SUCCESSFUL"):
+        mask = outcomes == status
+        if not mask.any():
+            continue
+        transitioned = ids[mask].tolist()
+        users = sorted(set(user_ids[mask].tolist()))
+        # Chunked to stay under the bound-parameter limits of SQLite and PostgreSQL
+        for i in range(0, len(transitioned), UPDATE_CHUNK):
+            session.query(Challenge).filter(
+                Challenge.id.in_(transitioned[i:i + UPDATE_CHUNK]), Challenge.status == "ACTIVE"
+            ).update({"status": status}, synchronize_session=False)
+        # Keep the legacy per-user account status in step
+        for i in range(0, len(users), UPDATE_CHUNK):
+            session.query(ChallengeAccount).filter(
+                ChallengeAccount.user_id.in_(users[i:i + UPDATE_CHUNK])
+            ).update({"status": status}, synchronize_session=False)
+        result[status] = transitioned
+    return result
+
+
+def evaluate_all_challenges(poller=None) -> None:
+    """
+    Poller job: one sweep over every ACTIVE challenge, so daily and total loss limits
+    are enforced even for challenges that are neither trading nor being re-marked.
+    """
+    evaluate_challenges(db.session)
+    db.session.commit()
+
+
+def roll_daily_equity(poller=None) -> int:
+    """
+    Poller job: starts a new trading day for every ACTIVE challenge that has not been
+    rolled yet today (UTC). Closes the previous day's snapshot with its end equity and
+    realized PnL, keeps the best daily gain (consistency rule), records current equity as
+    start-of-day equity and resets the intraday realized PnL accumulator. All three steps
+    are set-based statements and idempotent, so the job can run every minute and on any
+    worker. Returns the challenges rolled.
+
+    A challenge that has never been rolled and was already updated today (e.g. the first
+    run after a deploy) only gets today's snapshot, from its stored start-of-day equity,
+    so the day's losses so far still count against the daily-loss rule.
+    """
+    today = datetime.now(timezone.utc).date()
+    session = db.session
+    snapshots = DailyEquitySnapshot.__table__
+    challenges = Challenge.__table__
+
+    rolled_today = (
+        select(snapshots.c.id)
+        .where(snapshots.c.challenge_id == challenges.c.id, snapshots.c.day == today)
+        .exists()
+    )
+    never_rolled = ~select(snapshots.c.id).where(snapshots.c.challenge_id == challenges.c.id).exists()
+    started_today = and_(never_rolled, challenges.c.last_equity_update >= datetime(today.year, today.month, today.day))
+
+    session.execute(
+        snapshots.update()
+        .where(snapshots.c.day < today, snapshots.c.end_equity.is_(None))
+        .values(
+            end_equity=select(challenges.c.current_equity)
+            .where(challenges.c.id == snapshots.c.challenge_id)
+            .scalar_subquery(),
+            realized_pnl=select(challenges.c.day_realized_pnl)
+            .where(challenges.c.id == snapshots.c.challenge_id)
+            .scalar_subquery(),
+        )
+    )
+    day_gain = challenges.c.current_equity - func.coalesce(challenges.c.yesterday_equity, challenges.c.starting_balance)
+    rolled = session.execute(
+        challenges.update()
+        .where(challenges.c.status == "ACTIVE", ~rolled_today, ~started_today)
+        .values(
+            best_day_pnl=case((day_gain > func.coalesce(challenges.c.best_day_pnl, 0.0), day_gain), else_=challenges.c.best_day_pnl),
+            yesterday_equity=challenges.c.current_equity,
+            day_realized_pnl=0.0,
+        )
+    ).rowcount
+    session.execute(
+        snapshots.insert().from_select(
+            ["challenge_id", "day", "start_equity"],
+            select(
+                challenges.c.id,
+                literal(today),
+                func.coalesce(challenges.c.yesterday_equity, challenges.c.starting_balance),
+            ).where(challenges.c.status == "ACTIVE", ~rolled_today),
+        )
+    )
+    session.commit()
+    return rolled
@@ -0,0 +1,275 @@
+import time
+import zlib
+
+import numpy as np
+from sqlalchemy import bindparam, delete, insert
+
+from app import db
+from app.models import EquitySample, EquitySeriesChunk
+
+
+# Bar width, chunk period and retention (None keeps forever) of each tier, in seconds.
+# A chunk holds one period of bars: a day of 1m bars, 30 days of 1h bars, a year of 1d bars.
+TIERS = {
+    "1m": {"step": 60, "period": 86400, "retention": 7 * 86400},
+    "1h": {"step": 3600, "period": 30 * 86400, "retention": 180 * 86400},
+    "1d": {"step": 86400, "period": 365 * 86400, "retention": None},
+}
+
+COLUMNS = ("time", "open", "high", "low", "close")
+CHALLENGE_CHUNK = 5000  # challenge ids per IN (...) when loading chunks
+SAMPLE_CHUNK = 5000  # sample ids per DELETE ... IN (...) after compaction
+
+
+def empty_columns() -> dict:
+    columns = {name: np.empty(0, dtype=np.float64) for name in COLUMNS}
+    columns["time"] = np.empty(0, dtype=np.int64)
+    return columns
+
+
+def encode(columns: dict) -> bytes:
+    """
+    Packs bar columns into a blob: times and cent-rounded OHLC as int64 rows, each
+    delta-encoded against its previous bar, then zlib-compressed. Equity moves little
+    from bar to bar, so the deltas are small and compress well.
+    """
+    matrix = np.vstack([
+        columns["time"].astype(np.int64),
+        *(np.rint(columns[name] * 100.0).astype(np.int64) for name in COLUMNS[1:]),
+    ])
+    return zlib.compress(np.diff(matrix, axis=1, prepend=0).astype("<i8").tobytes())
+
+
+def decode(data: bytes, bars: int) -> dict:
+    matrix = np.cumsum(np.frombuffer(zlib.decompress(data), dtype="<i8").reshape(len(COLUMNS), bars), axis=1)
+    columns = {name: matrix[i] / 100.0 for i, name in enumerate(COLUMNS)}
+    columns["time"] = matrix[0]
+    return columns
+
+
+def aggregate(owner: np.ndarray, columns: dict, step: int):
+    """
+    Folds bars (or raw samples, with open = high = low = close) sorted by (owner, time)
+    into `step`-second bars aligned to the epoch, per owner, with one reduceat pass per
+    field. Returns (owner per bar, bar columns).
+    """
+    times = columns["time"]
+    if len(times) == 0:
+        return owner, columns
+
+    buckets = times - times % step
+    boundary = np.ones(len(times), dtype=bool)
+    boundary[1:] = (owner[1:] != owner[:-1]) | (buckets[1:] != buckets[:-1])
+    starts = np.flatnonzero(boundary)
+    ends = np.concatenate((starts[1:], [len(times)])) - 1
+
+    return owner[starts], {
+        "time": buckets[starts],
+        "open": columns["open"][starts],
+        "high": np.maximum.reduceat(columns["high"], starts),
+        "low": np.minimum.reduceat(columns["low"], starts),
+        "close": columns["close"][ends],
+    }
+
+
+def merge(older: dict, newer: dict, step: int) -> dict:
+    """
+    Merges two bar series of one challenge. Bars sharing an open time are combined
+    (the older bar keeps its open, the newer one sets the close), so late samples and
+    still-forming bars fold into the bar they belong to.
+    """
+    joined = {name: np.concatenate((older[name], newer[name])) for name in COLUMNS}
+    order = np.argsort(joined["time"], kind="stable")
+    joined = {name: values[order] for name, values in joined.items()}
+    return aggregate(np.zeros(len(order), dtype=np.int64), joined, step)[1]
+
+
+def _slice(columns: dict, mask) -> dict:
+    return {name: values[mask] for name, values in columns.items()}
+
+
+def record_samples(session, challenge_ids, equities, ts: int | None = None) -> None:
+    """
+    Appends one raw equity mark per challenge. The caller commits.
+    """
+    ts = int(ts if ts is not None else time.time())
+    rows = [
+        {"challenge_id": int(challenge_id), "ts": ts, "equity": float(equity)}
+        for challenge_id, equity in zip(challenge_ids, equities)
+    ]
+    if rows:
+        session.execute(insert(EquitySample), rows)
+
+
+def _write_tier(session, tier: str, owner: np.ndarray, bars: dict) -> None:
+    step, period = TIERS[tier]["step"], TIERS[tier]["period"]
+    periods = bars["time"] - bars["time"] % period
+
+    wanted = sorted(set(owner.tolist()))
+    existing = {}
+    for i in range(0, len(wanted), CHALLENGE_CHUNK):
+        for chunk in EquitySeriesChunk.query.filter(
+            EquitySeriesChunk.tier == tier,
+            EquitySeriesChunk.challenge_id.in_(wanted[i:i + CHALLENGE_CHUNK]),
+            EquitySeriesChunk.period_start >= int(periods.min()),
+        ):
+            existing[(chunk.challenge_id, chunk.period_start)] = chunk
+
+    boundary = np.ones(len(owner), dtype=bool)
+    boundary[1:] = (owner[1:] != owner[:-1]) | (periods[1:] != periods[:-1])
+    starts = np.flatnonzero(boundary).tolist()
+    updates, inserts = [], []
+    for start, end in zip(starts, starts[1:] + [len(owner)]):
+        key = (int(owner[start]), int(periods[start]))
+        segment = _slice(bars, slice(start, end))
+        chunk = existing.get(key)
+        if chunk is not None:
+            segment = merge(decode(chunk.data, chunk.bars), segment, step)
+        row = {
+            "data": encode(segment),
+            "bars": len(segment["time"]),
+            "last_ts": int(segment["time"][-1]),
+        }
+        if chunk is not None:
+            updates.append({"b_id": chunk.id, **row})
+        else:
+            inserts.append({"challenge_id": key[0], "tier": tier, "period_start": key[1], **row})
+
+    if updates:
+        table = EquitySeriesChunk.__table__
+        session.execute(
+            table.update()
+            .where(table.c.id == bindparam("b_id"))
+            .values(data=bindparam("data"), bars=bindparam("bars"), last_ts=bindparam("last_ts")),
+            updates,
+        )
+    if inserts:
+        session.execute(insert(EquitySeriesChunk), inserts)
+
+
+def prune_series(session, now: int | None = None) -> None:
+    """
+    Drops chunks whose whole period is older than their tier's retention.
+    """
+    now = int(now if now is not None else time.time())
+    for tier, spec in TIERS.items():
+        if spec["retention"] is None:
+            continue
+        session.execute(
+            delete(EquitySeriesChunk).where(
+                EquitySeriesChunk.tier == tier,
+                EquitySeriesChunk.period_start < now - spec["retention"] - spec["period"],
+            )
+        )
+
+
+def compact_series(poller=None) -> int:
+    """
+    Poller job: folds the raw samples of every completed minute into the 1m, 1h and 1d
+    bars of their challenges, deletes those samples and applies retention.
+
+    Samples are aggregated into minute bars with one reduceat pass and re-aggregated for
+    the coarser tiers; each touched chunk is decoded, merged and written back in one
+    executemany per tier. Returns the number of minute bars written.
+    """
+    now = int(time.time())
+    cutoff = now - now % 60
+    session = db.session
+
+    rows = (
+        session.query(EquitySample.id, EquitySample.challenge_id, EquitySample.ts, EquitySample.equity)
+        .filter(EquitySample.ts < cutoff)
+        .order_by(EquitySample.challenge_id, EquitySample.ts, EquitySample.id)
+        .all()
+    )
+    if not rows:
+        prune_series(session, now)
+        session.commit()
+        return 0
+
+    ids, owner, times, equity = (np.array(column) for column in zip(*rows))
+    equity = equity.astype(np.float64)
+    owner, minutes = aggregate(owner.astype(np.int64), {
+        "time": times.astype(np.int64),
+        "open": equity,
+        "high": equity,
+        "low": equity,
+        "close": equity,
+    }, TIERS["1m"]["step"])
+
+    for tier, spec in TIERS.items():
+        if tier == "1m":
+            _write_tier(session, tier, owner, minutes)
+        else:
+            _write_tier(session, tier, *aggregate(owner, minutes, spec["step"]))
+
+    # Exactly the samples read above: ids are not assigned in commit order, so a range
+    # delete could drop a sample committed after the read without compacting it
+    compacted = ids.tolist()
+    for i in range(0, len(compacted), SAMPLE_CHUNK):
+        session.execute(delete(EquitySample).where(EquitySample.id.in_(compacted[i:i + SAMPLE_CHUNK])))
+    prune_series(session, now)
+    session.commit()
+    return len(minutes["time"])
+
+
+def get_columns(challenge_id: int, tier: str, start: int, end: int) -> dict:
+    """
+    Equity bars of a challenge at one tier whose open time is in [start, end], ordered by
+    time, as one NumPy array per field. Samples not compacted yet are folded in, so the
+    newest bar is current.
+    """
+    step, period = TIERS[tier]["step"], TIERS[tier]["period"]
+    columns = empty_columns()
+    chunks = (
+        EquitySeriesChunk.query.filter(
+            EquitySeriesChunk.challenge_id == challenge_id,
+            EquitySeriesChunk.tier == tier,
+            EquitySeriesChunk.period_start > start - period,
+            EquitySeriesChunk.period_start <= end,
+        )
+        .order_by(EquitySeriesChunk.period_start)
+        .all()
+    )
+    for chunk in chunks:
+        columns = {name: np.concatenate((columns[name], values)) for name, values in decode(chunk.data, chunk.bars).items()}
+
+    samples = (
+        db.session.query(EquitySample.ts, EquitySample.equity)
+        .filter(
+            EquitySample.challenge_id == challenge_id,
+            EquitySample.ts >= start - start % step,
+            EquitySample.ts <= end + step,
+        )
+        .order_by(EquitySample.ts, EquitySample.id)
+        .all()
+    )
+    if samples:
+        times, equity = (np.array(column) for column in zip(*samples))
+        equity = equity.astype(np.float64)
+        recent = aggregate(np.zeros(len(times), dtype=np.int64), {
+            "time": times.astype(np.int64),
+            "open": equity,
+            "high": equity,
+            "low": equity,
+            "close": equity,
+        }, step)[1]
+        columns = merge(columns, recent, step)
+
+    return _slice(columns, (columns["time"] >= start - start % step) & (columns["time"] <= end))
+
+
+def default_tier(start: int, end: int) -> str:
+    """
+    Finest tier that keeps a range within a few thousand bars and inside retention.
+    """
+    span = end - start
+    if span <= 2 * 86400:
+        return "1m"
+    if span <= 90 * 86400:
+        return "1h"
+    return "1d"
+
+
+def to_payload(columns: dict) -> dict:
+    return {name: columns[name].tolist() for name in COLUMNS}
@@ -0,0 +1,278 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy.exc import DBAPIError
+
+from app import db, equity_series
+from app.models import Challenge, Position, Trade
+from app.portfolio import load_snapshot, record_fill, track_drawdown
+from app.rule_sets import rule_set_for
+from app.quote_cache import quote_cache
+
+
+# Oldest quote (seconds) a market order may fill against
+FILL_MAX_QUOTE_AGE = float(os.environ.get("FILL_MAX_QUOTE_AGE", 30))
+# Half the simulated bid/ask spread in basis points: buys fill above the quote, sells below
+FILL_HALF_SPREAD_BPS = float(os.environ.get("FILL_HALF_SPREAD_BPS", 0))
+# Attempts for a fill transaction that loses a deadlock or serialization conflict
+FILL_ATTEMPTS = 3
+# PostgreSQL SQLSTATEs of transactions that can simply be run again
+RETRYABLE_SQLSTATES = {"40P01", "40001"}  # deadlock_detected, serialization_failure
+
+
+class OrderRejected(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def market_fill_price(symbol: str, side: str) -> float:
+    """
+    Server-side fill price for a market order: the latest cached quote, fetched again
+    from the provider if it is older than FILL_MAX_QUOTE_AGE (even inside its cache TTL),
+    adjusted by the spread model.
+    """
+    from app.routes.market import get_quote
+
+    entry = quote_cache.get(symbol)
+    if entry is None or time.time() - entry["fetched_at"] > FILL_MAX_QUOTE_AGE:
+        try:
+            get_quote(symbol, max_age=FILL_MAX_QUOTE_AGE)
+        except Exception:
+            raise OrderRejected("Market price unavailable.", 503)
+        entry = quote_cache.get(symbol)
+        # get_quote falls back to the old quote when the provider fetch fails
+        if entry is None or time.time() - entry["fetched_at"] > FILL_MAX_QUOTE_AGE:
+            raise OrderRejected("Market data is stale, please retry shortly.", 503)
+
+    spread = entry["price"] * FILL_HALF_SPREAD_BPS / 10000.0
+    return entry["price"] + spread if side == "BUY" else entry["price"] - spread
+
+
+def price_order(
+    symbol: str, side: str, order_type: str = "MARKET", limit_price: float | None = None, stop_price: float | None = None
+) -> float:
+    """
+    Fill price for an immediately executable order. Limit-style orders must be marketable
+    now (a STOP_LIMIT also needs its stop crossed), judged like the order book does.
+    """
+    from app.order_book import fills_at
+
+    price = market_fill_price(symbol, side)
+    if order_type != "MARKET" and not fills_at(order_type, side, price, limit_price, stop_price):
+        if order_type == "STOP_LIMIT":
+            raise OrderRejected("Stop or limit price not reached.")
+        raise OrderRejected("Limit price not reached.")
+    return price
+
+
+# Process-local per-challenge locks, only used where the database ignores FOR UPDATE (SQLite)
+_challenge_locks = defaultdict(threading.Lock)
+_challenge_locks_guard = threading.Lock()
+
+
+@contextmanager
+def challenge_serialized(challenge_id: int):
+    """
+    Holds the in-process lock of one challenge on SQLite. On PostgreSQL the row locks
+    taken in apply_fill already serialize fills per challenge, so this is a no-op.
+    """
+    if db.session.get_bind().dialect.name != "sqlite":
+        yield
+        return
+    with _challenge_locks_guard:
+        lock = _challenge_locks[challenge_id]
+    with lock:
+        yield
+
+
+def apply_fill(challenge_id: int, symbol: str, side: str, quantity: float, price: float, pnl: float = 0.0) -> dict:
+    """
+    Applies one fill to a challenge's portfolio inside the current transaction, without
+    committing. The challenge row and the touched position rows are read with
+    SELECT ... FOR UPDATE, so concurrent fills for the same challenge queue up behind
+    each other while fills for other challenges proceed in parallel.
+
+    Returns {"trade": Trade, "cash": float}; raises OrderRejected if the fill is not allowed.
+    """
+    challenge = db.session.query(Challenge).filter_by(id=challenge_id).with_for_update().first()
+    if not challenge:
+        raise OrderRejected("Challenge not found.", 404)
+    if challenge.status != "ACTIVE":
+        raise OrderRejected("Challenge is not active.")
+
+    # Read before the fill touches any position, so a first-time build sees the pre-fill state
+    snapshot = load_snapshot(challenge, for_update=True)
+
+    positions = {
+        pos.symbol: pos
+        for pos in db.session.query(Position)
+        .filter(Position.challenge_id == challenge_id, Position.symbol.in_(["USD", symbol]))
+        .with_for_update()
+    }
+
+    # Binance-style: Cash is a Position (USD)
+    usd_pos = positions.get("USD")
+    if not usd_pos:
+        # Migration: If no USD position, assume current_balance is the initial cash
+        usd_pos = Position(
+            challenge_id=challenge_id,
+            symbol="USD",
+            quantity=challenge.current_balance,
+            avg_price=1.0,
+        )
+        db.session.add(usd_pos)
+
+    cost = price * quantity
+    pos = positions.get(symbol)
+
+    if side == "BUY":
+        # Check USD Position for liquidity
+        if usd_pos.quantity < cost:
+            raise OrderRejected("Insufficient buying power.")
+
+        # Plan position limit; a fill leaves equity unchanged, so the pre-fill equity applies
+        max_position_pct = rule_set_for(challenge.plan_name).rules["max_position_pct"]
+        if max_position_pct is not None:
+            held = pos.quantity if pos else 0.0
+            if (held + quantity) * price > snapshot.equity * max_position_pct / 100.0:
+                raise OrderRejected(f"Position would exceed {max_position_pct:g}% of equity.")
+
+        usd_pos.quantity -= cost
+
+        if pos:
+            new_qty = pos.quantity + quantity
+            # Weighted average price
+            pos.avg_price = ((pos.quantity * pos.avg_price) + cost) / new_qty
+            pos.quantity = new_qty
+        else:
+            pos = Position(challenge_id=challenge_id, symbol=symbol, quantity=quantity, avg_price=price)
+            db.session.add(pos)
+
+    elif side == "SELL":
+        if not pos or pos.quantity < quantity:
+            raise OrderRejected("Not enough shares to sell.")
+
+        usd_pos.quantity += cost
+        pos.quantity -= quantity
+
+        # Realized PnL for this trade (for stats only): (Sell Price - Avg Buy Price) * Quantity
+        pnl = (price - pos.avg_price) * quantity
+
+        if pos.quantity < 0.000001:  # Float epsilon
+            db.session.delete(pos)
+            pos = None
+
+    record_fill(snapshot, symbol, pos, usd_pos.quantity, price, pnl)
+
+    # challenge.current_balance is intentionally left alone: a fill swaps cash for an
+    # asset at the same value, so total equity only moves with prices. Equity follows
+    # the snapshot, re-marked with the fill price of the traded symbol.
+    challenge.current_equity = snapshot.equity
+    track_drawdown(challenge, snapshot.equity)
+    equity_series.record_samples(db.session, [challenge_id], [snapshot.equity])
+    challenge.last_equity_update = datetime.utcnow()
+    challenge.day_realized_pnl = (challenge.day_realized_pnl or 0.0) + pnl
+    today = datetime.utcnow().date()
+    if challenge.last_trade_day != today:
+        challenge.trading_days = (challenge.trading_days or 0) + 1
+        challenge.last_trade_day = today
+
+    trade = Trade(
+        challenge_id=challenge_id,
+        symbol=symbol,
+        side=side,
+        quantity=quantity,
+        price=price,
+        pnl=pnl,
+    )
+    db.session.add(trade)
+    db.session.flush()
+
+    return {"trade": trade, "cash": usd_pos.quantity}
+
+
+def _retryable(exc: Exception) -> bool:
+    return isinstance(exc, DBAPIError) and getattr(exc.orig, "pgcode", None) in RETRYABLE_SQLSTATES
+
+
+@contextmanager
+def fill_transaction():
+    """
+    Rolls back on any error. A deadlock or serialization failure is reported as a 503
+    OrderRejected instead of an unexpected database error.
+    """
+    try:
+        yield
+    except Exception as exc:
+        db.session.rollback()
+        if _retryable(exc):
+            raise OrderRejected("The order conflicted with a concurrent update, please retry.", 503) from exc
+        raise
+
+
+def retry_conflicts(fn):
+    """
+    Runs fn(), re-running it up to FILL_ATTEMPTS times while it loses a database
+    conflict (fill_transaction has already rolled it back).
+    """
+    for attempt in range(FILL_ATTEMPTS):
+        try:
+            return fn()
+        except OrderRejected as exc:
+            if not _retryable(exc.__cause__) or attempt == FILL_ATTEMPTS - 1:
+                raise
+
+
+def execute_fill(challenge_id: int, symbol: str, side: str, quantity: float, price: float, pnl: float = 0.0) -> dict:
+    """
+    apply_fill as one atomic transaction: committed on success, rolled back on rejection,
+    retried when it loses a deadlock.
+    """
+    def attempt():
+        with challenge_serialized(challenge_id), fill_transaction():
+            result = apply_fill(challenge_id, symbol, side, quantity, price, pnl)
+            db.session.commit()
+        return result
+
+    return retry_conflicts(attempt)
+
+
+def execute_batch(challenge_id: int, orders: list[dict]) -> list[dict]:
+    """
+    Applies an ordered list of orders for one challenge in a single transaction.
+
+    Each order is priced and filled in turn; a rejected order is reported and skipped
+    without affecting the others (fills validate before they modify anything). The
+    commit schedules one rule evaluation for the whole batch; a batch that loses a
+    deadlock is re-run as a whole.
+    """
+    def attempt():
+        results = []
+        with challenge_serialized(challenge_id), fill_transaction():
+            for order in orders:
+                try:
+                    price = price_order(
+                        order["symbol"], order["side"], order["orderType"], order["limitPrice"], order["stopPrice"]
+                    )
+                    fill = apply_fill(challenge_id, order["symbol"], order["side"], order["quantity"], price)
+                except OrderRejected as exc:
+                    if exc.status == 404:
+                        raise
+                    results.append({"status": "REJECTED", "message": exc.message})
+                    continue
+                results.append({
+                    "status": "FILLED",
+                    "tradeId": fill["trade"].id,
+                    "fillPrice": price,
+                    "cashBalance": fill["cash"],
+                })
+            db.session.commit()
+        return results
+
+    return retry_conflicts(attempt)
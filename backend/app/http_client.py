@@ -0,0 +1,63 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+DEFAULT_POOL_SIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+
+# Keep-alive connections held per upstream host
+HOST_POOL_SIZES = {
+    "api.binance.com": 20,
+    "www.casablancabourse.com": 4,
+    "api-m.paypal.com": 10,
+    "api-m.sandbox.paypal.com": 10,
+}
+
+
+def _retry_policy() -> Retry:
+    # Connection errors are retried for every method (the request never reached the server);
+    # read errors and 429/5xx responses only for idempotent methods, so a PayPal POST is never replayed.
+    # At most two retries, a single one after a read timeout, with short backoff sleeps and
+    # Retry-After ignored, so a call takes at most about three times its timeout; the circuit
+    # breaker in providers.py backs off a provider that keeps failing.
+    return Retry(
+        total=2,
+        connect=2,
+        read=1,
+        status=2,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+
+
+def build_session() -> requests.Session:
+    """
+    A requests.Session whose connection pools are reused across threads and requests,
+    so outbound calls skip the TCP and TLS handshake once a host has been contacted.
+    """
+    session = requests.Session()
+    default_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=DEFAULT_POOL_SIZE, max_retries=_retry_policy())
+    session.mount("https://", default_adapter)
+    session.mount("http://", default_adapter)
+    for host, size in HOST_POOL_SIZES.items():
+        session.mount(
+            f"https://{host}/",
+            HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=_retry_policy()),
+        )
+    return session
+
+
+session = build_session()
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return session.get(url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return session.post(url, **kwargs)
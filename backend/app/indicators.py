@@ -0,0 +1,233 @@
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from app import candle_store
+
+
+RSI_PERIOD = 14
+EMA_FAST = 12
+EMA_SLOW = 26
+MACD_SIGNAL = 9
+BB_PERIOD = 20
+BB_STDDEV = 2.0
+ATR_PERIOD = 14
+
+INDICATORS = ("rsi", "ema", "macd", "bollinger", "atr")
+BAR_INTERVAL = "1d"
+
+
+def _ema_step(previous, value: float, period: int) -> float:
+    if previous is None:
+        return value
+    alpha = 2.0 / (period + 1)
+    return previous + alpha * (value - previous)
+
+
+class IndicatorState:
+    """
+    Running indicator state for one symbol. update() folds in one closed bar in O(1):
+    Wilder RSI and ATR keep smoothed averages, EMAs/MACD keep their last value, and
+    Bollinger bands keep a fixed-size window with running sum and sum of squares.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.last_ts = None
+        self.prev_close = None
+
+        self._changes = 0
+        self._gain_sum = 0.0
+        self._loss_sum = 0.0
+        self.avg_gain = None
+        self.avg_loss = None
+
+        self.ema_fast = None
+        self.ema_slow = None
+        self.macd_signal = None
+
+        self._window = deque()
+        self._sum = 0.0
+        self._sumsq = 0.0
+
+        self._tr_count = 0
+        self._tr_sum = 0.0
+        self.atr = None
+
+    def update(self, ts: int, high: float, low: float, close: float) -> None:
+        if self.prev_close is not None:
+            change = close - self.prev_close
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            self._changes += 1
+            if self.avg_gain is None:
+                self._gain_sum += gain
+                self._loss_sum += loss
+                if self._changes == RSI_PERIOD:
+                    self.avg_gain = self._gain_sum / RSI_PERIOD
+                    self.avg_loss = self._loss_sum / RSI_PERIOD
+            else:
+                self.avg_gain = (self.avg_gain * (RSI_PERIOD - 1) + gain) / RSI_PERIOD
+                self.avg_loss = (self.avg_loss * (RSI_PERIOD - 1) + loss) / RSI_PERIOD
+
+            true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+            self._tr_count += 1
+            if self.atr is None:
+                self._tr_sum += true_range
+                if self._tr_count == ATR_PERIOD:
+                    self.atr = self._tr_sum / ATR_PERIOD
+            else:
+                self.atr = (self.atr * (ATR_PERIOD - 1) + true_range) / ATR_PERIOD
+
+        self.ema_fast = _ema_step(self.ema_fast, close, EMA_FAST)
+        self.ema_slow = _ema_step(self.ema_slow, close, EMA_SLOW)
+        self.macd_signal = _ema_step(self.macd_signal, self.ema_fast - self.ema_slow, MACD_SIGNAL)
+
+        self._window.append(close)
+        self._sum += close
+        self._sumsq += close * close
+        if len(self._window) > BB_PERIOD:
+            dropped = self._window.popleft()
+            self._sum -= dropped
+            self._sumsq -= dropped * dropped
+
+        self.prev_close = close
+        self.last_ts = ts
+        self.count += 1
+
+    def rsi(self):
+        if self.avg_gain is None:
+            return None
+        if self.avg_loss == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + self.avg_gain / self.avg_loss)
+
+    def values(self) -> dict:
+        out = {"rsi": self.rsi(), "ema": None, "macd": None, "bollinger": None, "atr": self.atr}
+        if self.count >= EMA_SLOW:
+            out["ema"] = {"fast": self.ema_fast, "slow": self.ema_slow}
+        if self.count >= EMA_SLOW + MACD_SIGNAL:
+            macd = self.ema_fast - self.ema_slow
+            out["macd"] = {"macd": macd, "signal": self.macd_signal, "histogram": macd - self.macd_signal}
+        if len(self._window) == BB_PERIOD:
+            mean = self._sum / BB_PERIOD
+            std = math.sqrt(max(self._sumsq / BB_PERIOD - mean * mean, 0.0))
+            out["bollinger"] = {
+                "middle": mean,
+                "upper": mean + BB_STDDEV * std,
+                "lower": mean - BB_STDDEV * std,
+            }
+        return out
+
+
+class IndicatorEngine:
+    """
+    Keeps one IndicatorState per symbol, fed from the daily series in the candle store.
+
+    Only closed bars are folded in, so results stay valid until the current bar closes;
+    until then they are served from cache without touching the store or yfinance.
+    """
+
+    def __init__(self, interval: str = BAR_INTERVAL):
+        self.interval = interval
+        self.step = candle_store.INTERVAL_SECONDS[interval]
+        self._states = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str) -> tuple[int, dict]:
+        """
+        Returns (closed bar count, indicator values) for symbol.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._results.get(symbol)
+            if cached and now < cached[0]:
+                return cached[1], cached[2]
+
+        candle_store.refresh(symbol, self.interval)
+        with self._lock:
+            state = self._states.setdefault(symbol, IndicatorState())
+            current_bar = int(now) - int(now) % self.step
+            columns = candle_store.get_columns(
+                symbol,
+                self.interval,
+                start=state.last_ts + 1 if state.last_ts is not None else None,
+                end=current_bar - 1,
+            )
+            for ts, high, low, close in zip(
+                columns["time"].tolist(), columns["high"].tolist(), columns["low"].tolist(), columns["close"].tolist()
+            ):
+                state.update(ts, high, low, close)
+
+            values = state.values()
+            self._results[symbol] = (current_bar + self.step, state.count, values)
+            return state.count, values
+
+    def refresh_tracked(self, poller) -> None:
+        """
+        Poller job: recomputes indicators for tracked symbols whose bar has closed.
+        """
+        from app.routes.market import MOROCCAN_SYMBOLS
+
+        now = time.time()
+        for symbol in poller.symbols():
+            if symbol in MOROCCAN_SYMBOLS:
+                continue
+            cached = self._results.get(symbol)
+            if cached and now < cached[0]:
+                continue
+            try:
+                self.get(symbol)
+            except Exception as e:
+                print(f"Indicator refresh failed for {symbol}: {e}")
+
+
+indicator_engine = IndicatorEngine()
+
+
+def wilder_rsi_matrix(closes: np.ndarray, period: int = RSI_PERIOD) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Wilder RSI for many symbols at once. `closes` is a (symbols x bars) float matrix
+    where missing bars are NaN (e.g. weekends for stocks next to crypto).
+
+    Each row's valid closes are right-aligned and every row is computed over all of its
+    own bars: a row is seeded at its own first `period` changes and only smoothed after
+    that, while the steps run across all rows at once. A row's RSI therefore matches
+    IndicatorState over the same bars, whatever other rows are in the batch. Returns
+    (rsi, bar_count) per row; rsi is NaN where a row has fewer than period + 1 bars.
+    """
+    valid = ~np.isnan(closes)
+    counts = valid.sum(axis=1)
+    rsi = np.full(len(closes), np.nan)
+    usable = counts > period
+    if not usable.any():
+        return rsi, counts
+
+    # Stable sort on the validity mask moves each row's NaNs to the front, keeping bar order
+    order = np.argsort(valid, axis=1, kind="stable")
+    aligned = np.take_along_axis(closes, order, axis=1)[usable]
+    deltas = np.diff(aligned, axis=1)
+    # NaN deltas (before a row's first bar) compare false and count as neither gain nor loss
+    gains = np.where(deltas > 0, deltas, 0.0)
+    losses = np.where(deltas < 0, -deltas, 0.0)
+
+    # Row i's changes occupy deltas[i, first[i]:]; its seed is the mean of the first `period`
+    rows = np.arange(len(aligned))
+    first = aligned.shape[1] - counts[usable]
+    seeded = first + period
+    gain_sums = np.concatenate((np.zeros((len(aligned), 1)), np.cumsum(gains, axis=1)), axis=1)
+    loss_sums = np.concatenate((np.zeros((len(aligned), 1)), np.cumsum(losses, axis=1)), axis=1)
+    avg_gain = (gain_sums[rows, seeded] - gain_sums[rows, first]) / period
+    avg_loss = (loss_sums[rows, seeded] - loss_sums[rows, first]) / period
+    for t in range(int(seeded.min()), deltas.shape[1]):
+        active = t >= seeded
+        avg_gain = np.where(active, (avg_gain * (period - 1) + gains[:, t]) / period, avg_gain)
+        avg_loss = np.where(active, (avg_loss * (period - 1) + losses[:, t]) / period, avg_loss)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+    rsi[usable] = values
+    return rsi, counts
@@ -0,0 +1,92 @@
+import os
+import queue
+import threading
+
+
+WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2.0  # seconds; doubles on every attempt
+
+
+class JobQueue:
+    """
+    In-process background job queue with a small pool of worker threads.
+
+    Jobs run inside the Flask app context. A job that raises is retried with
+    exponential backoff up to MAX_ATTEMPTS times. Jobs enqueued with a `key` are
+    deduplicated while one with the same key is still pending, so repeated triggers
+    for the same work (e.g. a redirect and a webhook for one order) run it once.
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._app = None
+
+    def is_running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self, app) -> None:
+        if self.is_running():
+            return
+        self._app = app
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def enqueue(self, fn, *args, key=None) -> bool:
+        """
+        Schedules fn(*args). Returns False if a job with the same key is already pending.
+        Without running workers (scripts, tests) the job runs inline.
+        """
+        if key is not None:
+            with self._lock:
+                if key in self._pending:
+                    return False
+                self._pending.add(key)
+
+        if not self.is_running():
+            try:
+                fn(*args)
+            finally:
+                self._release(key)
+            return True
+
+        self._queue.put((fn, args, key, 1))
+        return True
+
+    def _release(self, key) -> None:
+        if key is not None:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _work(self) -> None:
+        from app import db
+
+        while True:
+            fn, args, key, attempt = self._queue.get()
+            try:
+                with self._app.app_context():
+                    try:
+                        fn(*args)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                if attempt < MAX_ATTEMPTS:
+                    delay = RETRY_BASE_DELAY * 2 ** (attempt - 1)
+                    print(f"Job {fn.__name__}{args} failed (attempt {attempt}), retrying in {delay:.0f}s: {e}")
+                    timer = threading.Timer(delay, self._queue.put, args=((fn, args, key, attempt + 1),))
+                    timer.daemon = True
+                    timer.start()
+                    continue
+                print(f"Job {fn.__name__}{args} failed permanently: {e}")
+            self._release(key)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+
+from app.quote_cache import SQLiteQuoteBackend, quote_cache
+
+
+# Symbols offered by the frontend asset selector; anything requested through the API is added on first use.
+DEFAULT_SYMBOLS = ["AAPL", "TSLA", "GOOGL", "MSFT", "BTC-USD", "ETH-USD", "IAM.PA", "ATW.PA"]
+POLL_INTERVAL = float(os.environ.get("MARKET_POLL_INTERVAL", 2))
+# Requested symbols stop being polled after this many seconds without a request
+SYMBOL_IDLE_TTL = float(os.environ.get("MARKET_SYMBOL_IDLE_TTL", 900))
+# A failed symbol is retried after FAILURE_BACKOFF_BASE * 2^(failures - 1) seconds, capped
+FAILURE_BACKOFF_BASE = 5.0
+FAILURE_BACKOFF_MAX = 300.0
+# Consecutive failures after which a requested (non-default) symbol is dropped
+MAX_SYMBOL_FAILURES = 8
+LOCK_PATH = os.environ.get(
+    "MARKET_POLLER_LOCK",
+    os.path.join(os.path.dirname(__file__), "..", "instance", "market_poller.lock"),
+)
+
+
+class MarketPoller:
+    """
+    Background thread that keeps the quote cache warm for the tracked symbol universe,
+    so request handlers never wait on an upstream provider.
+
+    Quotes are refreshed whenever their asset-class TTL runs out. The default symbols
+    are always polled; a symbol requested through track() (or read from the shared cache
+    by another worker) is polled until it goes SYMBOL_IDLE_TTL seconds without a request.
+    Failing symbols back off exponentially and requested ones are dropped after
+    MAX_SYMBOL_FAILURES consecutive failures. Extra periodic jobs
+    (candle refresh, indicators, ...) can be registered with register_job and run
+    inside the Flask app context on the same thread.
+
+    When the quote cache is shared between processes (SQLite backend) only one
+    gunicorn worker polls at a time, elected through a file lock; the other workers
+    read the shared store and take over if the leader exits.
+    """
+
+    def __init__(self, symbols=None, interval: float = POLL_INTERVAL):
+        self.interval = interval
+        self._pinned = set(symbols or DEFAULT_SYMBOLS)
+        self._requested = {}  # symbol -> wall-clock time of the last track()
+        self._symbols_lock = threading.Lock()
+        self._jobs = []
+        self._failed_at = {}
+        self._failures = {}  # symbol -> consecutive failed refreshes
+        self._thread = None
+        self._stop = threading.Event()
+        self._app = None
+        self._lock_file = None
+
+    def track(self, symbol: str) -> None:
+        """
+        Marks symbol as requested now, adding it to the polled set.
+        """
+        with self._symbols_lock:
+            self._requested[symbol] = time.time()
+
+    def symbols(self) -> list[str]:
+        with self._symbols_lock:
+            return sorted(self._pinned | set(self._requested))
+
+    def register_job(self, name: str, interval: float, fn) -> None:
+        """
+        Runs fn(poller) every `interval` seconds on the poller thread, inside the app context.
+        """
+        self._jobs = [job for job in self._jobs if job["name"] != name]
+        self._jobs.append({"name": name, "interval": interval, "fn": fn, "next_run": 0.0})
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, app) -> None:
+        if self.is_running():
+            return
+        self._app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="market-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _is_leader(self) -> bool:
+        if not isinstance(quote_cache.backend, SQLiteQuoteBackend):
+            return True
+        if self._lock_file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            return True
+
+        os.makedirs(os.path.dirname(os.path.abspath(LOCK_PATH)), exist_ok=True)
+        lock_file = open(LOCK_PATH, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            if self._is_leader():
+                try:
+                    self.poll_quotes()
+                except Exception as e:
+                    print(f"Market poller error: {e}")
+                self._run_due_jobs()
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(0.0, self.interval - elapsed))
+
+    def _universe(self, now: float) -> set[str]:
+        cutoff = now - SYMBOL_IDLE_TTL
+        with self._symbols_lock:
+            self._requested = {symbol: at for symbol, at in self._requested.items() if at >= cutoff}
+            universe = self._pinned | set(self._requested)
+        # Symbols requested on another worker show up as recent reads of a shared cache
+        universe |= set(quote_cache.symbols(accessed_since=cutoff))
+        for symbol in [s for s in self._failures if s not in universe]:
+            self._failures.pop(symbol, None)
+            self._failed_at.pop(symbol, None)
+        return universe
+
+    def _backing_off(self, symbol: str, now: float) -> bool:
+        failures = self._failures.get(symbol)
+        if not failures:
+            return False
+        delay = min(FAILURE_BACKOFF_BASE * 2 ** (failures - 1), FAILURE_BACKOFF_MAX)
+        return now - self._failed_at[symbol] < delay
+
+    def poll_quotes(self) -> None:
+        # Imported lazily: the market routes import this module.
+        from app.routes.market import _asset_class, _fetch_quotes
+
+        now = time.time()
+        due = [
+            s
+            for s in sorted(self._universe(now))
+            if not self._backing_off(s, now) and quote_cache.lookup(s, _asset_class(s), touch=False)[1] != "fresh"
+        ]
+        if not due:
+            return
+
+        fetched = _fetch_quotes(due)
+        now = time.time()
+        for symbol in due:
+            if symbol in fetched:
+                price, change = fetched[symbol]
+                quote_cache.put(symbol, price, change, fetched_at=now)
+                self._failed_at.pop(symbol, None)
+                self._failures.pop(symbol, None)
+                continue
+            # Keep serving the last quote; its age tells clients it is stale.
+            self._failed_at[symbol] = now
+            self._failures[symbol] = self._failures.get(symbol, 0) + 1
+            if self._failures[symbol] >= MAX_SYMBOL_FAILURES and symbol not in self._pinned:
+                with self._symbols_lock:
+                    self._requested.pop(symbol, None)
+
+    def _run_due_jobs(self) -> None:
+        now = time.monotonic()
+        for job in self._jobs:
+            if now < job["next_run"]:
+                continue
+            job["next_run"] = now + job["interval"]
+            try:
+                with self._app.app_context():
+                    job["fn"](self)
+            except Exception as e:
+                print(f"Market poller job '{job['name']}' failed: {e}")
+
+
+market_poller = MarketPoller()
+
+
+def start_market_poller(app) -> None:
+    if os.environ.get("MARKET_POLLER_ENABLED", "1") != "1":
+        return
+
+    from app import candle_store, equity_series, portfolio, synthetic_candles
+    from app.challenge_engine import evaluate_all_challenges, roll_daily_equity
+    from app.indicators import indicator_engine
+
+    market_poller.register_job("candles", 60, candle_store.refresh_stored_symbols)
+    market_poller.register_job("synthetic-candles", 15, synthetic_candles.record_live_prices)
+    market_poller.register_job("indicators", 300, indicator_engine.refresh_tracked)
+    market_poller.register_job("mark-to-market", portfolio.MARK_INTERVAL, portfolio.mark_to_market)
+    market_poller.register_job("held-symbols", 60, portfolio.track_held_symbols)
+    quote_cache.subscribe(portfolio.note_price)
+    market_poller.register_job("daily-equity", 60, roll_daily_equity)
+    market_poller.register_job("challenge-rules", 60, evaluate_all_challenges)
+    market_poller.register_job("equity-series", 60, equity_series.compact_series)
+    market_poller.start(app)
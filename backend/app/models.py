@@ -23,8 +23,14 @@ class Challenge(db.Model):
     max_daily_loss_pct = db.Column(db.Float, nullable=False, default=5.0)
     max_total_loss_pct = db.Column(db.Float, nullable=False, default=5.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    yesterday_equity = db.Column(db.Float, nullable=True)
+    yesterday_equity = db.Column(db.Float, nullable=True)  # equity at the start of the current UTC day
     last_equity_update = db.Column(db.DateTime, default=datetime.utcnow)
+    day_realized_pnl = db.Column(db.Float, nullable=False, default=0.0)  # realized PnL since the start of the day
+    trading_days = db.Column(db.Integer, nullable=False, default=0)  # distinct UTC days with a fill
+    last_trade_day = db.Column(db.Date, nullable=True)
+    best_day_pnl = db.Column(db.Float, nullable=False, default=0.0)  # largest closed-day equity gain
+    equity_high_water_mark = db.Column(db.Float, nullable=True)  # highest marked equity, starting balance until first mark
+    max_drawdown_pct = db.Column(db.Float, nullable=False, default=0.0)  # deepest fall from the high-water mark, in %
 
 
 class Position(db.Model):
@@ -56,6 +62,7 @@ class Payment(db.Model):
     currency = db.Column(db.String(10), nullable=False, default="DH")
     status = db.Column(db.String(20), default="completed")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    provider_order_id = db.Column(db.String(64), unique=True, nullable=True)
 
 
 class PayPalConfig(db.Model):
@@ -76,3 +83,107 @@ class AdminRole(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, unique=True)
     role = db.Column(db.String(20), nullable=False, default="admin")
+
+
+class Candle(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint("symbol", "interval", "ts", name="uq_candle_symbol_interval_ts"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(20), nullable=False)
+    interval = db.Column(db.String(5), nullable=False)
+    ts = db.Column(db.Integer, nullable=False)  # bar open time, unix seconds (UTC)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class DailyEquitySnapshot(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint("challenge_id", "day", name="uq_daily_equity_challenge_day"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(db.Integer, db.ForeignKey("challenge.id"), nullable=False)
+    day = db.Column(db.Date, nullable=False)  # UTC
+    start_equity = db.Column(db.Float, nullable=False)
+    end_equity = db.Column(db.Float, nullable=True)  # filled when the next day starts
+    realized_pnl = db.Column(db.Float, nullable=True)
+
+
+class RestingOrder(db.Model):
+    __table_args__ = (
+        db.Index("ix_resting_order_status_id", "status", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(db.Integer, db.ForeignKey("challenge.id"), nullable=False, index=True)
+    symbol = db.Column(db.String(20), nullable=False)
+    side = db.Column(db.String(10), nullable=False)
+    order_type = db.Column(db.String(20), nullable=False)  # LIMIT, STOP, TAKE_PROFIT, STOP_LIMIT
+    quantity = db.Column(db.Float, nullable=False)
+    limit_price = db.Column(db.Float, nullable=True)
+    stop_price = db.Column(db.Float, nullable=True)
+    oco_group = db.Column(db.String(36), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default="OPEN")  # OPEN, FILLED, CANCELLED, REJECTED
+    message = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    triggered_at = db.Column(db.DateTime, nullable=True)  # stop of a STOP_LIMIT order was hit
+    filled_at = db.Column(db.DateTime, nullable=True)
+    fill_price = db.Column(db.Float, nullable=True)
+    trade_id = db.Column(db.Integer, db.ForeignKey("trade.id"), nullable=True)
+
+
+class PortfolioSnapshot(db.Model):
+    """
+    Materialized portfolio of one challenge, kept in step with its Position rows by every
+    fill and re-marked from the quote stream. `version` changes on every fill so that a
+    re-mark computed from an older view of the positions is discarded.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(db.Integer, db.ForeignKey("challenge.id"), nullable=False, unique=True)
+    cash = db.Column(db.Float, nullable=False, default=0.0)
+    positions = db.Column(db.JSON, nullable=False, default=dict)  # symbol -> {"quantity", "avgPrice"}
+    prices = db.Column(db.JSON, nullable=False, default=dict)  # symbol -> last mark price
+    cost_basis = db.Column(db.Float, nullable=False, default=0.0)
+    realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    market_value = db.Column(db.Float, nullable=False, default=0.0)
+    equity = db.Column(db.Float, nullable=False, default=0.0)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    marked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EquitySample(db.Model):
+    """
+    Raw equity marks of a challenge (mark-to-market runs and fills), kept only until
+    app.equity_series compacts them into EquitySeriesChunk bars.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(db.Integer, db.ForeignKey("challenge.id"), nullable=False, index=True)
+    ts = db.Column(db.Integer, nullable=False, index=True)  # unix seconds (UTC)
+    equity = db.Column(db.Float, nullable=False)
+
+
+class EquitySeriesChunk(db.Model):
+    """
+    One period of a challenge's equity bars at one tier (1m, 1h, 1d), stored as a
+    compressed columnar blob (see app.equity_series.encode).
+    """
+
+    __table_args__ = (
+        db.UniqueConstraint("challenge_id", "tier", "period_start", name="uq_equity_chunk_challenge_tier_period"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(db.Integer, db.ForeignKey("challenge.id"), nullable=False)
+    tier = db.Column(db.String(5), nullable=False)
+    period_start = db.Column(db.Integer, nullable=False)  # unix seconds, aligned to the tier's period
+    last_ts = db.Column(db.Integer, nullable=False)  # open time of the newest bar
+    bars = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.LargeBinary, nullable=False)
@@ -0,0 +1,357 @@
+import heapq
+import itertools
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from app import db
+from app.execution import OrderRejected, apply_fill, challenge_serialized, market_fill_price
+from app.models import RestingOrder
+from app.quote_cache import quote_cache
+
+
+ORDER_TYPES = ("LIMIT", "STOP", "TAKE_PROFIT", "STOP_LIMIT")
+SYNC_INTERVAL = 5  # seconds between reloads of open orders placed by other workers
+
+
+def trigger_condition(order_type: str, side: str, limit_price, stop_price, triggered: bool = False):
+    """
+    Returns (level, direction) for a resting order: it triggers once the price is at or
+    "above"/"below" level. Limits and take-profits wait for a better price, stops for a
+    worse one; a STOP_LIMIT whose stop was hit rests as a limit.
+    """
+    if order_type in ("LIMIT", "TAKE_PROFIT") or (order_type == "STOP_LIMIT" and triggered):
+        return limit_price, "below" if side == "BUY" else "above"
+    return stop_price, "above" if side == "BUY" else "below"
+
+
+def crosses(direction: str, level: float, price: float) -> bool:
+    return price >= level if direction == "above" else price <= level
+
+
+def required_prices(order_type: str) -> tuple[str, ...]:
+    return {
+        "LIMIT": ("limitPrice",),
+        "TAKE_PROFIT": ("limitPrice",),
+        "STOP": ("stopPrice",),
+        "STOP_LIMIT": ("stopPrice", "limitPrice"),
+    }.get(order_type, ())
+
+
+def fills_at(order_type: str, side: str, price: float, limit_price=None, stop_price=None) -> bool:
+    """
+    Whether an order placed now would fill immediately at price instead of resting.
+    """
+    if order_type == "MARKET":
+        return True
+    level, direction = trigger_condition(order_type, side, limit_price, stop_price)
+    if not crosses(direction, level, price):
+        return False
+    if order_type == "STOP_LIMIT":
+        level, direction = trigger_condition(order_type, side, limit_price, stop_price, triggered=True)
+        return crosses(direction, level, price)
+    return True
+
+
+class OrderBook:
+    """
+    In-memory index of open resting orders, one pair of heaps per symbol.
+
+    Orders that trigger on a rising price sit in a min-heap keyed by level, orders that
+    trigger on a falling price in a max-heap, so a tick only inspects heap tops and pops
+    the orders it triggers: O(log n) per triggered order, nothing for the rest.
+    Cancelled orders are removed lazily: they stay in the heap until they reach the top,
+    or until dead entries outnumber live ones and the symbol's heaps are compacted.
+    """
+
+    def __init__(self):
+        self._above = defaultdict(list)  # symbol -> [(level, seq, order_id)]
+        self._below = defaultdict(list)  # symbol -> [(-level, seq, order_id)]
+        self._live = {}  # order_id -> seq of its current heap entry
+        self._counts = defaultdict(int)  # symbol -> live orders
+        self._symbols = {}  # order_id -> symbol
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._live
+
+    def add(self, order_id: int, symbol: str, direction: str, level: float) -> None:
+        with self._lock:
+            if order_id in self._live:
+                self._discard(order_id)
+            seq = next(self._seq)
+            if direction == "above":
+                heapq.heappush(self._above[symbol], (level, seq, order_id))
+            else:
+                heapq.heappush(self._below[symbol], (-level, seq, order_id))
+            self._live[order_id] = seq
+            self._symbols[order_id] = symbol
+            self._counts[symbol] += 1
+
+    def symbols(self) -> list[str]:
+        with self._lock:
+            return list(self._counts)
+
+    def order_ids(self) -> set[int]:
+        with self._lock:
+            return set(self._live)
+
+    def remove(self, order_id: int) -> None:
+        with self._lock:
+            self._discard(order_id)
+
+    def _discard(self, order_id: int) -> None:
+        if self._live.pop(order_id, None) is None:
+            return
+        symbol = self._symbols.pop(order_id)
+        self._counts[symbol] -= 1
+        if not self._counts[symbol]:
+            # Last live order for the symbol: drop its heaps and their dead entries
+            del self._counts[symbol]
+            self._above.pop(symbol, None)
+            self._below.pop(symbol, None)
+        elif len(self._above[symbol]) + len(self._below[symbol]) > 2 * self._counts[symbol] + 64:
+            for heaps in (self._above, self._below):
+                heap = [entry for entry in heaps[symbol] if self._live.get(entry[2]) == entry[1]]
+                heapq.heapify(heap)
+                heaps[symbol] = heap
+
+    def pop_triggered(self, symbol: str, price: float) -> list[int]:
+        """
+        Removes and returns the ids of every order on symbol triggered by price.
+        """
+        if symbol not in self._counts:
+            return []
+        triggered = []
+        with self._lock:
+            above = self._above.get(symbol, [])
+            while above and above[0][0] <= price:
+                _, seq, order_id = heapq.heappop(above)
+                if self._live.get(order_id) == seq:
+                    triggered.append(order_id)
+            below = self._below.get(symbol, [])
+            while below and -below[0][0] >= price:
+                _, seq, order_id = heapq.heappop(below)
+                if self._live.get(order_id) == seq:
+                    triggered.append(order_id)
+            for order_id in triggered:
+                self._discard(order_id)
+        return triggered
+
+
+order_book = OrderBook()
+
+
+def index_order(order: RestingOrder) -> None:
+    level, direction = trigger_condition(
+        order.order_type, order.side, order.limit_price, order.stop_price, order.triggered_at is not None
+    )
+    order_book.add(order.id, order.symbol, direction, level)
+
+
+def on_quote(symbol: str, price: float) -> None:
+    """
+    Quote listener: hands every order triggered by the new price to the job queue.
+    """
+    from app.jobs import job_queue
+
+    for order_id in order_book.pop_triggered(symbol, price):
+        job_queue.enqueue(execute_resting_order, order_id, key=("resting-order", order_id))
+
+
+def place_order(
+    challenge_id: int,
+    symbol: str,
+    side: str,
+    quantity: float,
+    order_type: str,
+    limit_price=None,
+    stop_price=None,
+    oco_group=None,
+) -> RestingOrder:
+    """
+    Stores a resting order, indexes it in the book and matches it against the current
+    quote right away. Cash and shares are not reserved; they are checked at fill time.
+    """
+    order = RestingOrder(
+        challenge_id=challenge_id,
+        symbol=symbol,
+        side=side,
+        order_type=order_type,
+        quantity=quantity,
+        limit_price=limit_price,
+        stop_price=stop_price,
+        oco_group=oco_group,
+        status="OPEN",
+    )
+    db.session.add(order)
+    db.session.commit()
+
+    index_order(order)
+    entry = quote_cache.get(symbol)
+    if entry is not None:
+        on_quote(symbol, entry["price"])
+    return order
+
+
+def place_oco(challenge_id: int, legs: list[dict]) -> list[RestingOrder]:
+    """
+    Places orders that cancel each other: the first one to fill cancels the rest.
+    """
+    group = str(uuid.uuid4())
+    orders = [
+        RestingOrder(challenge_id=challenge_id, oco_group=group, status="OPEN", **leg)
+        for leg in legs
+    ]
+    db.session.add_all(orders)
+    db.session.commit()
+
+    for order in orders:
+        index_order(order)
+    entry = quote_cache.get(orders[0].symbol)
+    if entry is not None:
+        on_quote(orders[0].symbol, entry["price"])
+    return orders
+
+
+def cancel_order(order_id: int) -> bool:
+    cancelled = (
+        db.session.query(RestingOrder)
+        .filter_by(id=order_id, status="OPEN")
+        .update({"status": "CANCELLED"}, synchronize_session=False)
+    )
+    db.session.commit()
+    order_book.remove(order_id)
+    return bool(cancelled)
+
+
+def execute_resting_order(order_id: int) -> None:
+    """
+    Job: fills a triggered order through the execution engine.
+
+    The order is priced first, outside any write transaction, since that may fetch a
+    quote from the provider. It is then claimed with a conditional OPEN -> FILLED update
+    in the fill's own transaction, so a tick seen by several workers fills it once. A
+    limit that is no longer marketable, or a quote that went stale, puts the order back
+    in the book.
+    """
+    order = db.session.get(RestingOrder, order_id)
+    if order is None or order.status != "OPEN":
+        return
+
+    try:
+        price = market_fill_price(order.symbol, order.side)
+    except OrderRejected:
+        # No usable quote right now; the next tick retries
+        db.session.rollback()
+        index_order(order)
+        return
+
+    # A STOP_LIMIT is only handed to this job once its stop was hit; from then on it rests as a limit
+    newly_triggered = order.order_type == "STOP_LIMIT" and order.triggered_at is None
+    triggered = newly_triggered or order.triggered_at is not None
+    level, direction = trigger_condition(order.order_type, order.side, order.limit_price, order.stop_price, triggered)
+    if not crosses(direction, level, price):
+        # The price moved back before the fill (or a STOP_LIMIT now rests at its limit)
+        if newly_triggered:
+            db.session.query(RestingOrder).filter_by(id=order_id, status="OPEN").update(
+                {"triggered_at": datetime.utcnow()}, synchronize_session=False
+            )
+            db.session.commit()
+            db.session.refresh(order)
+        else:
+            db.session.rollback()
+        if order.status == "OPEN":
+            index_order(order)
+        return
+
+    with challenge_serialized(order.challenge_id):
+        claimed = (
+            db.session.query(RestingOrder)
+            .filter_by(id=order_id, status="OPEN")
+            .update({"status": "FILLED"}, synchronize_session=False)
+        )
+        if not claimed:
+            db.session.rollback()
+            return
+        db.session.refresh(order)
+
+        try:
+            if newly_triggered and order.triggered_at is None:
+                order.triggered_at = datetime.utcnow()
+            fill = apply_fill(order.challenge_id, order.symbol, order.side, order.quantity, price)
+            order.status = "FILLED"
+            order.fill_price = price
+            order.filled_at = datetime.utcnow()
+            order.trade_id = fill["trade"].id
+
+            siblings = []
+            if order.oco_group:
+                siblings = [
+                    sibling_id
+                    for (sibling_id,) in db.session.query(RestingOrder.id).filter(
+                        RestingOrder.oco_group == order.oco_group,
+                        RestingOrder.id != order.id,
+                        RestingOrder.status == "OPEN",
+                    )
+                ]
+                if siblings:
+                    db.session.query(RestingOrder).filter(RestingOrder.id.in_(siblings)).update(
+                        {"status": "CANCELLED"}, synchronize_session=False
+                    )
+            db.session.commit()
+        except OrderRejected as exc:
+            db.session.rollback()
+            order = db.session.get(RestingOrder, order_id)
+            if exc.status == 503:
+                # No usable quote right now; the next tick retries
+                index_order(order)
+                return
+            order.status = "REJECTED"
+            order.message = exc.message
+            db.session.commit()
+            return
+        except Exception:
+            db.session.rollback()
+            index_order(db.session.get(RestingOrder, order_id))
+            raise
+
+    for sibling_id in siblings:
+        order_book.remove(sibling_id)
+
+
+def sync_open_orders(poller=None) -> None:
+    """
+    Poller job: reconciles the book with the database, indexing orders placed on other
+    workers and dropping those cancelled there, and keeps the symbols of open orders in
+    the polled set. Only the ids of open orders are read (from the status index); full
+    rows are loaded for the missing ones.
+    """
+    open_ids = {
+        order_id for (order_id,) in db.session.query(RestingOrder.id).filter(RestingOrder.status == "OPEN")
+    }
+    indexed = order_book.order_ids()
+    for order_id in indexed - open_ids:
+        order_book.remove(order_id)
+    missing = open_ids - indexed
+    if missing:
+        for order in RestingOrder.query.filter(RestingOrder.id.in_(missing)):
+            index_order(order)
+    # Resting orders only trigger while their symbols keep being polled
+    if poller is not None:
+        for symbol in order_book.symbols():
+            poller.track(symbol)
+
+
+def start_order_matcher(app) -> None:
+    from app.market_poller import market_poller
+
+    with app.app_context():
+        sync_open_orders()
+    quote_cache.subscribe(on_quote)
+    market_poller.register_job("resting-orders", SYNC_INTERVAL, sync_open_orders)
@@ -0,0 +1,297 @@
+import threading
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import and_, bindparam, func, select
+
+from app import db, equity_series
+from app.challenge_engine import evaluate_challenges
+from app.models import Challenge, PortfolioSnapshot, Position, Trade
+from app.quote_cache import quote_cache
+
+
+MARK_INTERVAL = 2  # seconds between mark-to-market runs (runs only do work after a quote moved)
+EQUITY_EPSILON = 1e-6
+
+_moved = set()
+_moved_lock = threading.Lock()
+
+
+def _totals(cash: float, positions: dict, prices: dict) -> dict:
+    cost_basis = sum(p["quantity"] * p["avgPrice"] for p in positions.values())
+    market_value = sum(p["quantity"] * prices.get(symbol, p["avgPrice"]) for symbol, p in positions.items())
+    return {
+        "cost_basis": cost_basis,
+        "market_value": market_value,
+        "equity": cash + market_value,
+    }
+
+
+def build_snapshot(challenge) -> PortfolioSnapshot:
+    """
+    Builds the snapshot of a challenge from its Position and Trade rows (challenges that
+    traded before snapshots existed). Positions are marked at their average price.
+    """
+    rows = Position.query.filter_by(challenge_id=challenge.id).all()
+    usd = next((p for p in rows if p.symbol == "USD"), None)
+    cash = usd.quantity if usd else challenge.current_balance
+    positions = {
+        p.symbol: {"quantity": p.quantity, "avgPrice": p.avg_price}
+        for p in rows
+        if p.symbol != "USD"
+    }
+    prices = {symbol: p["avgPrice"] for symbol, p in positions.items()}
+    realized = (
+        db.session.query(func.coalesce(func.sum(Trade.pnl), 0.0))
+        .filter(Trade.challenge_id == challenge.id)
+        .scalar()
+    )
+    return PortfolioSnapshot(
+        challenge_id=challenge.id,
+        cash=cash,
+        positions=positions,
+        prices=prices,
+        realized_pnl=realized or 0.0,
+        version=0,
+        marked_at=datetime.utcnow(),
+        **_totals(cash, positions, prices),
+    )
+
+
+def load_snapshot(challenge, for_update: bool = False) -> PortfolioSnapshot:
+    """
+    The stored snapshot of a challenge, built and added to the session on first use.
+    """
+    query = PortfolioSnapshot.query.filter_by(challenge_id=challenge.id)
+    if for_update:
+        query = query.with_for_update()
+    snapshot = query.first()
+    if snapshot is None:
+        snapshot = build_snapshot(challenge)
+        db.session.add(snapshot)
+    return snapshot
+
+
+def record_fill(snapshot: PortfolioSnapshot, symbol: str, position, cash: float, price: float, pnl: float) -> None:
+    """
+    Folds one fill into the snapshot. `position` is the symbol's Position after the fill,
+    or None once it has been closed.
+    """
+    positions = dict(snapshot.positions or {})
+    prices = dict(snapshot.prices or {})
+    if position is None:
+        positions.pop(symbol, None)
+        prices.pop(symbol, None)
+    else:
+        positions[symbol] = {"quantity": position.quantity, "avgPrice": position.avg_price}
+        prices[symbol] = price
+
+    # JSON columns are only written when reassigned
+    snapshot.positions = positions
+    snapshot.prices = prices
+    snapshot.cash = cash
+    snapshot.realized_pnl = (snapshot.realized_pnl or 0.0) + pnl
+    snapshot.version = (snapshot.version or 0) + 1
+    snapshot.marked_at = datetime.utcnow()
+    for key, value in _totals(cash, positions, prices).items():
+        setattr(snapshot, key, value)
+
+
+def note_price(symbol: str, price: float) -> None:
+    """
+    Quote listener: remembers which symbols moved since the last mark-to-market run.
+    """
+    with _moved_lock:
+        _moved.add(symbol)
+
+
+def track_held_symbols(poller) -> None:
+    """
+    Poller job: keeps every symbol held by an active challenge in the polled set, so
+    open positions keep being marked while nobody views them.
+    """
+    held = (
+        db.session.query(Position.symbol)
+        .join(Challenge, Challenge.id == Position.challenge_id)
+        .filter(Challenge.status == "ACTIVE", Position.symbol != "USD")
+        .distinct()
+    )
+    for (symbol,) in held:
+        poller.track(symbol)
+
+
+def track_drawdown(challenge, equity: float) -> None:
+    """
+    Folds a new equity mark into the challenge's high-water mark and max drawdown, O(1).
+    """
+    peak = max(challenge.equity_high_water_mark or challenge.starting_balance, equity)
+    challenge.equity_high_water_mark = peak
+    drawdown = (peak - equity) / peak * 100.0 if peak > 0 else 0.0
+    challenge.max_drawdown_pct = max(challenge.max_drawdown_pct or 0.0, drawdown)
+
+
+def mark_to_market(poller=None) -> int:
+    """
+    Poller job: revalues every active portfolio after prices moved.
+
+    Holdings are flattened into (portfolio, quantity, price) arrays and valued with one
+    bincount; only portfolios whose equity changed are written back, snapshot marks and
+    Challenge.current_equity (with its high-water mark and max drawdown) each in one
+    executemany UPDATE, then the challenge rules run for them and their new equity is
+    appended to the equity series. Nothing is read or written while no quote has moved.
+    Snapshots whose version changed since they were read (a fill landed meanwhile) are
+    left to the fill, which writes its own equity. Returns the number of portfolios revalued.
+    """
+    with _moved_lock:
+        moved = set(_moved)
+        _moved.clear()
+    if not moved:
+        return 0
+
+    # Cash-only portfolios have nothing to re-mark
+    rows = (
+        db.session.query(
+            PortfolioSnapshot.id,
+            PortfolioSnapshot.challenge_id,
+            PortfolioSnapshot.version,
+            PortfolioSnapshot.cash,
+            PortfolioSnapshot.equity,
+            PortfolioSnapshot.positions,
+            PortfolioSnapshot.prices,
+            func.coalesce(Challenge.equity_high_water_mark, Challenge.starting_balance).label("high_water_mark"),
+            func.coalesce(Challenge.max_drawdown_pct, 0.0).label("max_drawdown_pct"),
+        )
+        .join(Challenge, Challenge.id == PortfolioSnapshot.challenge_id)
+        .filter(Challenge.status == "ACTIVE", PortfolioSnapshot.market_value != 0)
+        .order_by(PortfolioSnapshot.challenge_id)
+        .all()
+    )
+    if not rows:
+        return 0
+
+    latest = {}
+    owner, quantities, marks = [], [], []
+    for index, row in enumerate(rows):
+        stored = row.prices or {}
+        for symbol, position in (row.positions or {}).items():
+            if symbol not in latest:
+                if poller is not None:
+                    poller.track(symbol)
+                entry = quote_cache.get(symbol)
+                latest[symbol] = entry["price"] if entry else None
+            price = latest[symbol]
+            if price is None:
+                price = stored.get(symbol, position["avgPrice"])
+            owner.append(index)
+            quantities.append(position["quantity"])
+            marks.append(price)
+
+    cash = np.fromiter((row.cash for row in rows), dtype=float, count=len(rows))
+    previous = np.fromiter((row.equity for row in rows), dtype=float, count=len(rows))
+    owner = np.asarray(owner, dtype=np.intp)
+    values = np.asarray(quantities, dtype=float) * np.asarray(marks, dtype=float)
+    market_value = np.bincount(owner, weights=values, minlength=len(rows))
+    equity = cash + market_value
+    changed = np.flatnonzero(np.abs(equity - previous) > EQUITY_EPSILON)
+    if not len(changed):
+        return 0
+
+    # Trailing high-water mark and max drawdown, folded in per mark like track_drawdown
+    peak = np.maximum(np.fromiter((row.high_water_mark for row in rows), dtype=float, count=len(rows)), equity)
+    drawdown = np.where(peak > 0, (peak - equity) / np.where(peak > 0, peak, 1.0) * 100.0, 0.0)
+    max_drawdown = np.maximum(
+        np.fromiter((row.max_drawdown_pct for row in rows), dtype=float, count=len(rows)), drawdown
+    )
+
+    now = datetime.utcnow()
+    snapshot_updates, challenge_updates = [], []
+    for index in changed.tolist():
+        row = rows[index]
+        prices = dict(row.prices or {})
+        prices.update({s: latest[s] for s in (row.positions or {}) if latest.get(s) is not None})
+        snapshot_updates.append({
+            "b_id": row.id,
+            "b_version": row.version,
+            "prices": prices,
+            "market_value": float(market_value[index]),
+            "equity": float(equity[index]),
+            "marked_at": now,
+        })
+        challenge_updates.append({
+            "b_id": row.challenge_id,
+            "b_version": row.version,
+            "current_equity": float(equity[index]),
+            "equity_high_water_mark": float(peak[index]),
+            "max_drawdown_pct": float(max_drawdown[index]),
+            "last_equity_update": now,
+        })
+
+    # Challenge rows are written before snapshot rows, the order apply_fill locks them in,
+    # so a fill racing this run waits for it instead of deadlocking with it
+    snapshots = PortfolioSnapshot.__table__
+    challenges = Challenge.__table__
+    current_snapshot = (
+        select(snapshots.c.id)
+        .where(snapshots.c.challenge_id == challenges.c.id, snapshots.c.version == bindparam("b_version"))
+        .exists()
+    )
+    db.session.execute(
+        challenges.update()
+        .where(and_(challenges.c.id == bindparam("b_id"), current_snapshot))
+        .values(
+            current_equity=bindparam("current_equity"),
+            equity_high_water_mark=bindparam("equity_high_water_mark"),
+            max_drawdown_pct=bindparam("max_drawdown_pct"),
+            last_equity_update=bindparam("last_equity_update"),
+        ),
+        challenge_updates,
+    )
+    db.session.execute(
+        snapshots.update()
+        .where(and_(snapshots.c.id == bindparam("b_id"), snapshots.c.version == bindparam("b_version")))
+        .values(
+            prices=bindparam("prices"),
+            market_value=bindparam("market_value"),
+            equity=bindparam("equity"),
+            marked_at=bindparam("marked_at"),
+        ),
+        snapshot_updates,
+    )
+
+    changed_ids = [rows[index].challenge_id for index in changed.tolist()]
+    equity_series.record_samples(db.session, changed_ids, equity[changed].tolist())
+    evaluate_challenges(db.session, changed_ids)
+    db.session.commit()
+    return len(changed)
+
+
+def serialize_snapshot(snapshot: PortfolioSnapshot) -> dict:
+    """
+    Portfolio payload from the snapshot alone. Quotes already in the in-process cache
+    refine the stored marks; nothing is fetched from a provider.
+    """
+    positions = []
+    market_value = 0.0
+    for symbol, position in (snapshot.positions or {}).items():
+        entry = quote_cache.get(symbol)
+        price = entry["price"] if entry else (snapshot.prices or {}).get(symbol, position["avgPrice"])
+        value = position["quantity"] * price
+        market_value += value
+        positions.append({
+            "symbol": symbol,
+            "quantity": position["quantity"],
+            "avgPrice": position["avgPrice"],
+            "marketValue": value,
+            "currentPrice": price,
+        })
+
+    return {
+        "positions": positions,
+        "cashBalance": snapshot.cash,
+        "totalEquity": snapshot.cash + market_value,
+        "costBasis": snapshot.cost_basis,
+        "realizedPnl": snapshot.realized_pnl,
+        "unrealizedPnl": market_value - snapshot.cost_basis,
+        "markedAt": snapshot.marked_at.isoformat() if snapshot.marked_at else None,
+        "challengeId": snapshot.challenge_id,
+    }
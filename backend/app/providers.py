@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
+
+FAILURE_THRESHOLD = int(os.environ.get("PROVIDER_FAILURE_THRESHOLD", 3))
+RESET_TIMEOUT = float(os.environ.get("PROVIDER_RESET_TIMEOUT", 30))
+# Bounds on how long a hedged call waits for the primary before firing the secondary
+HEDGE_MIN_DELAY = 0.2
+HEDGE_MAX_DELAY = 2.0
+
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="provider-hedge")
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class NoDataError(LookupError):
+    """
+    The provider answered, but has no data for the requested symbol.
+    """
+
+
+def is_outage(exc: Exception, outage_errors: tuple = ()) -> bool:
+    """
+    Whether an error means the provider itself is unavailable: a transport error, a
+    timeout, an HTTP 5xx or 429, or one of the provider's own outage_errors. Anything
+    else (unknown symbol, 4xx, unparsable answer) is about the request, not the provider.
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status >= 500 or status == 429
+    # requests and curl_cffi errors derive from OSError, as does the builtin TimeoutError
+    return isinstance(exc, (OSError, TimeoutError, *outage_errors))
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker. After `failure_threshold` consecutive failures the
+    circuit opens and calls fail immediately; after `reset_timeout` seconds a single
+    trial call is let through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """
+        Ends a call that neither proves nor disproves the provider is up, so a half-open
+        circuit lets the next trial through.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 100):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+
+class Provider:
+    """
+    Wraps an upstream market data function with a circuit breaker and latency tracking.
+    Only outages (see is_outage) count as breaker failures, so requests for unknown
+    symbols cannot open the circuit for everyone else.
+    """
+
+    def __init__(self, name: str, fn, outage_errors: tuple = ()):
+        self.name = name
+        self.fn = fn
+        self.outage_errors = outage_errors
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+
+    def call(self, *args, **kwargs):
+        if self.breaker.state != "closed" and not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        started = time.monotonic()
+        try:
+            result = self.fn(*args, **kwargs)
+        except Exception as exc:
+            if is_outage(exc, self.outage_errors):
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+            raise
+        self.latency.record(time.monotonic() - started)
+        self.breaker.record_success()
+        return result
+
+    def hedge_delay(self) -> float:
+        p95 = self.latency.percentile(95)
+        if p95 is None:
+            return HEDGE_MAX_DELAY
+        return min(max(p95, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def status(self) -> dict:
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "name": self.name,
+            "state": self.breaker.state,
+            "consecutiveFailures": self.breaker.failures,
+            "p50Ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95Ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+def _probe(provider: Provider, *args) -> None:
+    try:
+        provider.call(*args)
+    except Exception:
+        pass
+
+
+def hedged_call(primary: Provider, secondary: Provider, *args):
+    """
+    Calls primary; if it has not answered within its p95 latency, also calls secondary
+    and returns whichever succeeds first. An open primary circuit or a fast primary
+    failure goes straight to the secondary.
+    """
+    if primary.breaker.state != "closed":
+        # Serve from the secondary; the primary's half-open trial (if due) runs on the side
+        _hedge_executor.submit(_probe, primary, *args)
+        return secondary.call(*args)
+
+    first = _hedge_executor.submit(primary.call, *args)
+    try:
+        return first.result(timeout=primary.hedge_delay())
+    except TimeoutError:
+        pass
+    except Exception:
+        return secondary.call(*args)
+
+    backup = _hedge_executor.submit(secondary.call, *args)
+    error = None
+    for future in as_completed([first, backup]):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
@@ -0,0 +1,275 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Seconds a quote is served as fresh, per asset class.
+DEFAULT_TTLS = {
+    "crypto": float(os.environ.get("QUOTE_TTL_CRYPTO", 5)),
+    "stock": float(os.environ.get("QUOTE_TTL_STOCK", 15)),
+    "morocco": float(os.environ.get("QUOTE_TTL_MOROCCO", 60)),
+}
+# Extra seconds an expired quote may still be served while it is refreshed in the background.
+STALE_GRACE = float(os.environ.get("QUOTE_STALE_GRACE", 30))
+MAX_ENTRIES = int(os.environ.get("QUOTE_CACHE_MAX_ENTRIES", 512))
+# Seconds between batched accessed_at writes of the shared (SQLite) backend
+ACCESS_FLUSH_INTERVAL = float(os.environ.get("QUOTE_ACCESS_FLUSH_INTERVAL", 5))
+
+
+class MemoryQuoteBackend:
+    """
+    Per-process LRU store. Fastest option, but each gunicorn worker keeps its own copy.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._accessed = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str, touch: bool = True):
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is not None and touch:
+                self._entries.move_to_end(symbol)
+                self._accessed[symbol] = time.time()
+            return entry
+
+    def set(self, symbol: str, entry: dict) -> None:
+        # A refresh of an existing quote is not an access, so it keeps its LRU position
+        with self._lock:
+            self._entries[symbol] = entry
+            self._accessed.setdefault(symbol, time.time())
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._accessed.pop(evicted, None)
+
+    def symbols(self, accessed_since: float | None = None) -> list[str]:
+        with self._lock:
+            if accessed_since is None:
+                return list(self._entries)
+            return [symbol for symbol in self._entries if self._accessed.get(symbol, 0.0) >= accessed_since]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._accessed.clear()
+
+
+class SQLiteQuoteBackend:
+    """
+    Shared store backed by a local SQLite file (WAL mode), so every gunicorn worker
+    on the host reads the same quote. LRU order is tracked with an accessed_at column.
+
+    Reads never write: accesses are remembered in process and written in one batched
+    UPDATE at most every ACCESS_FLUSH_INTERVAL seconds, so LRU order lags by that much
+    and a busy writer lock only delays the batch instead of failing a read.
+    """
+
+    def __init__(self, path: str, max_entries: int = MAX_ENTRIES, flush_interval: float = ACCESS_FLUSH_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._accessed = {}
+        self._accessed_lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS quote ("
+            " symbol TEXT PRIMARY KEY,"
+            " price REAL NOT NULL,"
+            " change REAL NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, symbol: str, touch: bool = True):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT price, change, fetched_at FROM quote WHERE symbol = ?", (symbol,)
+        ).fetchone()
+        if row is None:
+            return None
+        if touch:
+            self._note_access(symbol)
+        return {"price": row[0], "change": row[1], "fetched_at": row[2]}
+
+    def _note_access(self, symbol: str) -> None:
+        now = time.time()
+        with self._accessed_lock:
+            self._accessed[symbol] = now
+            if now - self._flushed_at < self.flush_interval:
+                return
+            pending, self._accessed = self._accessed, {}
+            self._flushed_at = now
+        try:
+            self._conn().executemany(
+                "UPDATE quote SET accessed_at = MAX(accessed_at, ?) WHERE symbol = ?",
+                [(accessed_at, pending_symbol) for pending_symbol, accessed_at in pending.items()],
+            )
+        except sqlite3.OperationalError as e:
+            # Writer lock busy: keep the accesses for the next flush
+            print(f"Quote cache access flush deferred: {e}")
+            with self._accessed_lock:
+                for pending_symbol, accessed_at in pending.items():
+                    self._accessed[pending_symbol] = max(accessed_at, self._accessed.get(pending_symbol, 0.0))
+
+    def set(self, symbol: str, entry: dict) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO quote (symbol, price, change, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(symbol) DO UPDATE SET price = excluded.price, change = excluded.change,"
+            " fetched_at = excluded.fetched_at",
+            (symbol, entry["price"], entry["change"], entry["fetched_at"], time.time()),
+        )
+        conn.execute(
+            "DELETE FROM quote WHERE symbol IN ("
+            " SELECT symbol FROM quote ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def symbols(self, accessed_since: float | None = None) -> list[str]:
+        if accessed_since is None:
+            return [row[0] for row in self._conn().execute("SELECT symbol FROM quote")]
+        return [
+            row[0]
+            for row in self._conn().execute("SELECT symbol FROM quote WHERE accessed_at >= ?", (accessed_since,))
+        ]
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM quote")
+
+
+class QuoteCache:
+    """
+    Read-through quote cache shared by every market data provider.
+
+    A quote younger than its asset-class TTL is returned as is. Within the stale grace
+    window the cached quote is returned immediately and refreshed in the background
+    (stale-while-revalidate). Older or missing quotes are fetched synchronously; if that
+    fetch fails, the last known quote is returned instead of an error.
+    """
+
+    def __init__(self, backend, ttls: dict | None = None, stale_grace: float = STALE_GRACE):
+        self.backend = backend
+        self.ttls = dict(ttls or DEFAULT_TTLS)
+        self.stale_grace = stale_grace
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._executor = None
+        self._listeners = []
+
+    def ttl_for(self, asset_class: str) -> float:
+        return self.ttls.get(asset_class, self.ttls.get("stock", 15.0))
+
+    def get(self, symbol: str):
+        return self.backend.get(symbol)
+
+    def symbols(self, accessed_since: float | None = None) -> list[str]:
+        """
+        Cached symbols, optionally only those read since the given wall-clock time.
+        """
+        return self.backend.symbols(accessed_since)
+
+    def subscribe(self, listener) -> None:
+        """
+        Calls listener(symbol, price) for every quote stored in this process.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def put(self, symbol: str, price: float, change: float, fetched_at: float | None = None) -> dict:
+        entry = {
+            "price": float(price),
+            "change": float(change),
+            "fetched_at": fetched_at if fetched_at is not None else time.time(),
+        }
+        self.backend.set(symbol, entry)
+        for listener in self._listeners:
+            try:
+                listener(symbol, entry["price"])
+            except Exception as e:
+                print(f"Quote listener failed for {symbol}: {e}")
+        return entry
+
+    def lookup(self, symbol: str, asset_class: str, touch: bool = True):
+        """
+        Returns (entry, state) where state is "fresh", "stale" (servable while refreshing),
+        "expired" or "missing". touch=False checks freshness without counting as an access.
+        """
+        cached = self.backend.get(symbol, touch)
+        if not cached:
+            return None, "missing"
+        age = time.time() - cached["fetched_at"]
+        ttl = self.ttl_for(asset_class)
+        if age < ttl:
+            return cached, "fresh"
+        if age < ttl + self.stale_grace:
+            return cached, "stale"
+        return cached, "expired"
+
+    def get_or_fetch(self, symbol: str, fetcher, asset_class: str, max_age: float | None = None) -> tuple[float, float]:
+        """
+        Serves a cached quote or fetches a new one. max_age (seconds) treats anything older
+        as expired regardless of the asset class TTL, so the caller gets a synchronous fetch.
+        """
+        cached, state = self.lookup(symbol, asset_class)
+        if cached and max_age is not None and time.time() - cached["fetched_at"] > max_age:
+            state = "expired"
+        if state == "fresh":
+            return cached["price"], cached["change"]
+        if state == "stale":
+            self.refresh_in_background(symbol, fetcher)
+            return cached["price"], cached["change"]
+
+        try:
+            price, change = fetcher(symbol)
+        except Exception:
+            if cached:
+                return cached["price"], cached["change"]
+            raise
+        self.put(symbol, price, change)
+        return price, change
+
+    def refresh_in_background(self, symbol: str, fetcher) -> None:
+        with self._refresh_lock:
+            if symbol in self._refreshing:
+                return
+            self._refreshing.add(symbol)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quote-refresh")
+        self._executor.submit(self._refresh, symbol, fetcher)
+
+    def _refresh(self, symbol: str, fetcher) -> None:
+        try:
+            price, change = fetcher(symbol)
+            self.put(symbol, price, change)
+        except Exception as e:
+            print(f"Background quote refresh failed for {symbol}: {e}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(symbol)
+
+
+def _backend_from_env():
+    kind = os.environ.get("QUOTE_CACHE_BACKEND", "memory").lower()
+    if kind == "sqlite":
+        default_path = os.path.join(os.path.dirname(__file__), "..", "instance", "quote_cache.db")
+        return SQLiteQuoteBackend(os.environ.get("QUOTE_CACHE_PATH", default_path))
+    return MemoryQuoteBackend()
+
+
+quote_cache = QuoteCache(_backend_from_env())
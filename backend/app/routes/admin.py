@@ -7,6 +7,7 @@ from sqlalchemy import func
 from app import db
 from app.challenge_engine import ChallengeAccount, VIRTUAL_START_BALANCE
 from app.models import AdminRole, Challenge, PayPalConfig, Payment, Trade, User
+from app.routes.payment import invalidate_paypal_token_cache
 
 
 admin_bp = Blueprint("admin", __name__)
@@ -99,6 +100,7 @@ def set_paypal_config():
         config.mode = mode
 
     db.session.commit()
+    invalidate_paypal_token_cache()
 
     return jsonify({"message": "PayPal configuration saved."})
 
@@ -1,9 +1,12 @@
+import time
+from datetime import timezone
+
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import get_jwt_identity, jwt_required
 
-from app import db
+from app import db, equity_series
 from app.models import Challenge
-from app.challenge_engine import _evaluate_account_for_user
+from app.rule_sets import rule_set_for
 
 challenge_bp = Blueprint("challenge", __name__)
 
@@ -13,8 +16,6 @@ def _get_current_user_id():
     return int(identity) if identity is not None else None
 
 
-from datetime import datetime, date
-
 @challenge_bp.route("/current", methods=["GET"])
 @jwt_required()
 def get_current_challenge():
@@ -31,23 +32,12 @@ def get_current_challenge():
     if not challenge:
         return jsonify({"challenge": None})
 
-    # Logic to handle new day rollover for Daily P&L
-    # If last_equity_update was yesterday (or earlier), snapshot the current_equity as yesterday_equity
-    # In a real system, this should happen at market close or midnight via cron.
-    # Here, we lazy-update on first access of the new day.
-    
-    today = date.today()
-    last_update_date = challenge.last_equity_update.date() if challenge.last_equity_update else today
-    
-    if today > last_update_date:
-        # It's a new day!
-        # Set yesterday_equity to whatever the equity was at the end of last session (current_equity)
-        challenge.yesterday_equity = challenge.current_equity
-        challenge.last_equity_update = datetime.utcnow()
-        db.session.commit()
-    
+    # yesterday_equity holds start-of-day equity, rolled over by the daily-equity poller job
     # If yesterday_equity is still None (e.g. fresh challenge), use starting_balance
     yesterday_equity = challenge.yesterday_equity if challenge.yesterday_equity is not None else challenge.starting_balance
+    # The high-water mark trails equity on every fill and mark-to-market run
+    high_water_mark = max(challenge.equity_high_water_mark or challenge.starting_balance, challenge.current_equity)
+    drawdown_pct = (high_water_mark - challenge.current_equity) / high_water_mark * 100.0 if high_water_mark > 0 else 0.0
 
     payload = {
         "id": challenge.id,
@@ -60,6 +50,10 @@ def get_current_challenge():
         "dailyLossLimit": challenge.max_daily_loss_pct,
         "totalLossLimit": challenge.max_total_loss_pct,
         "yesterdayEquity": yesterday_equity,
+        "todayRealizedPnl": challenge.day_realized_pnl,
+        "equityHighWaterMark": high_water_mark,
+        "currentDrawdownPct": drawdown_pct,
+        "maxDrawdownPct": max(challenge.max_drawdown_pct or 0.0, drawdown_pct),
     }
 
     return jsonify({"challenge": payload})
@@ -99,9 +93,7 @@ def start_challenge():
         starting_balance=starting_balance,
         current_balance=starting_balance,
         current_equity=starting_balance,
-        profit_target=10.0,
-        max_daily_loss_pct=5.0,
-        max_total_loss_pct=5.0,
+        **rule_set_for(plan_name).challenge_columns(),
     )
     db.session.add(challenge)
     db.session.commit()
@@ -130,26 +122,16 @@ def update_balance():
 
     data = request.get_json() or {}
     challenge_id = data.get("challengeId")
-    balance = data.get("currentBalance")
 
-    if not challenge_id or balance is None:
+    if not challenge_id:
         return jsonify({"message": "Invalid payload."}), 400
 
     challenge = Challenge.query.filter_by(id=challenge_id, user_id=user_id).first()
     if not challenge:
         return jsonify({"message": "Challenge not found."}), 404
 
-    # Update current_equity instead of current_balance
-    # In the new Binance-style system, current_balance is legacy/Cash-only
-    # and should not be overwritten by Total Equity.
-    challenge.current_equity = float(balance)
-
-    # Evaluate Challenge Rules (Total Loss / Profit Target)
-    # This ensures that equity updates from price changes trigger status updates.
-    _evaluate_account_for_user(db.session, user_id)
-
-    db.session.commit()
-
+    # Equity is marked to market on the server (app.portfolio.mark_to_market); a
+    # client-computed currentBalance is ignored and the stored state is returned.
     payload = {
         "id": challenge.id,
         "status": challenge.status,
@@ -163,3 +145,30 @@ def update_balance():
     }
 
     return jsonify({"challenge": payload})
+
+
+@challenge_bp.route("/<int:challenge_id>/equity", methods=["GET"])
+@jwt_required()
+def get_equity_series(challenge_id):
+    user_id = _get_current_user_id()
+    if not user_id:
+        return jsonify({"message": "Unauthorized"}), 401
+
+    challenge = Challenge.query.filter_by(id=challenge_id, user_id=user_id).first()
+    if not challenge:
+        return jsonify({"message": "Challenge not found."}), 404
+
+    # from/to are unix seconds; the range defaults to the whole challenge
+    end = request.args.get("to", type=int) or int(time.time())
+    start = request.args.get("from", type=int)
+    if start is None:
+        start = int(challenge.created_at.replace(tzinfo=timezone.utc).timestamp()) if challenge.created_at else end - 86400
+    if start > end:
+        return jsonify({"message": "from must not be after to."}), 400
+
+    tier = request.args.get("tier") or equity_series.default_tier(start, end)
+    if tier not in equity_series.TIERS:
+        return jsonify({"message": f"Unsupported tier. Use one of: {', '.join(equity_series.TIERS)}."}), 400
+
+    columns = equity_series.get_columns(challenge.id, tier, start, end)
+    return jsonify({"challengeId": challenge.id, "tier": tier, **equity_series.to_payload(columns)})
@@ -1,31 +1,61 @@
+import json
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 
-import requests
 import yfinance as yf
 from bs4 import BeautifulSoup
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from urllib3.exceptions import InsecureRequestWarning
+from yfinance.exceptions import YFRateLimitError
+
+from app import candle_aggregation, candle_store, http_client, synthetic_candles
+from app.candle_store import INTERVAL_SECONDS
+from app.indicators import INDICATORS, indicator_engine, wilder_rsi_matrix
+from app.market_poller import market_poller
+from app.providers import NoDataError, Provider, hedged_call
+from app.quote_cache import quote_cache
+
+warnings.simplefilter('ignore', InsecureRequestWarning)
 
 market_bp = Blueprint("market", __name__)
 
+MOROCCAN_SYMBOLS = {"IAM.PA", "ATW.PA"}
+CRYPTO_SYMBOLS = {"BTC-USD", "ETH-USD"}
+
+# Default chart window per requested interval when no ?from= is given
+DEFAULT_CHART_SPAN = {
+    "1m": 86400,
+    "5m": 5 * 86400,
+    "15m": 10 * 86400,
+    "1h": 30 * 86400,
+    "1d": 365 * 86400,
+}
+# Upper bound on bars per chart response; longer ranges are downsampled
+MAX_CHART_POINTS = 1500
+
+# Upper bound on symbols per batch signal request
+MAX_SIGNAL_SYMBOLS = 50
+
+# Shared pool for concurrent provider calls in batch quote lookups
+_batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="market-batch")
+
 
 def _get_binance_price(symbol: str) -> tuple[float, float]:
     # Map internal symbol to Binance symbol
     binance_symbol = symbol.replace("-", "").replace("USD", "USDT")
-    
-    try:
-        # Get 24hr ticker data which has both last price and price change percent
-        url = f"https://api.binance.com/api/v3/ticker/24hr?symbol={binance_symbol}"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        
-        current_price = float(data['lastPrice'])
-        change_percent = float(data['priceChangePercent'])
-        
-        return current_price, change_percent
-    except Exception as e:
-        print(f"Binance API error for {symbol}: {e}")
-        # Fallback to yfinance if Binance fails
-        return _get_yfinance_price(symbol)
+
+    # Get 24hr ticker data which has both last price and price change percent
+    url = f"https://api.binance.com/api/v3/ticker/24hr?symbol={binance_symbol}"
+    response = http_client.get(url, timeout=5)
+    # Unknown symbols come back as 400 {"code": -1121, "msg": "Invalid symbol."}
+    response.raise_for_status()
+    data = response.json()
+
+    current_price = float(data['lastPrice'])
+    change_percent = float(data['priceChangePercent'])
+
+    return current_price, change_percent
 
 def _get_yfinance_price(symbol: str) -> tuple[float, float]:
     ticker = yf.Ticker(symbol)
@@ -66,7 +96,7 @@ def _get_yfinance_price(symbol: str) -> tuple[float, float]:
     # 3. Ultimate Fallback (Daily Data)
     data = ticker.history(period="5d")
     if data.empty:
-        raise ValueError("No market data")
+        raise NoDataError(f"No market data for {symbol}")
     
     current_price = float(data["Close"].iloc[-1])
     
@@ -79,42 +109,14 @@ def _get_yfinance_price(symbol: str) -> tuple[float, float]:
     return current_price, change_percent
 
 def _get_international_price(symbol: str) -> tuple[float, float]:
-    # Use Binance for Crypto
-    if symbol in ["BTC-USD", "ETH-USD"]:
-        return _get_binance_price(symbol)
+    # Use Binance for Crypto, hedged with Yahoo Finance if Binance is slow or down
+    if symbol in CRYPTO_SYMBOLS:
+        return hedged_call(BINANCE, YAHOO, symbol)
     
     # Use Yahoo Finance for everything else
-    return _get_yfinance_price(symbol)
-
-
-def get_live_price(symbol: str) -> float:
-    """
-    Public helper to get the current price of a symbol.
-    Returns 0.0 if failed.
-    """
-    try:
-        if symbol in {"IAM.PA", "ATW.PA"}:
-            price, _ = _get_casablanca_price(symbol)
-        else:
-            price, _ = _get_international_price(symbol)
-        return price
-    except Exception:
-        return 0.0
+    return YAHOO.call(symbol)
 
 
-import warnings
-from urllib3.exceptions import InsecureRequestWarning
-
-warnings.simplefilter('ignore', InsecureRequestWarning)
-
-import time
-import random
-
-# Global Cache for Moroccan Data
-# { symbol: { 'price': float, 'change': float, 'last_fetch': timestamp } }
-MOROCCAN_CACHE = {}
-CACHE_DURATION = 60  # 1 minute cache to avoid blocking
-
 def _get_casablanca_price(symbol: str) -> tuple[float, float]:
     """
     Fetches price from casablancabourse.com directly.
@@ -127,167 +129,257 @@ def _get_casablanca_price(symbol: str) -> tuple[float, float]:
         "ATW": "ATW"
     }
     target_ticker = ticker_map.get(code, code)
+
+    url = f"https://www.casablancabourse.com/{target_ticker}/action/capitalisation/"
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    
+    # Verify=False to avoid SSL errors with some setups
+    response = http_client.get(url, headers=headers, timeout=10, verify=False)
+    response.raise_for_status()
+
+    soup = BeautifulSoup(response.text, "html.parser")
     
-    now_ts = time.time()
+    # Extract Price: Look for "Prix de l'action" -> parent -> previous sibling
+    price = 0.0
+    label = soup.find(string=lambda t: "Prix de l'action" in str(t) if t else False)
+    if label:
+        parent = label.parent
+        prev = parent.find_previous_sibling("div")
+        if prev:
+            # Text like "109.10 DH"
+            text = prev.get_text(strip=True).replace("DH", "").replace(" ", "").replace(",", ".")
+            price = float(text)
+
+    # Extract Change: Look for "Change (1 jour)" -> parent -> previous sibling
+    change_percent = 0.0
+    change_label = soup.find(string=lambda t: "Change (1 jour)" in str(t) if t else False)
+    if change_label:
+        parent = change_label.parent
+        prev = parent.find_previous_sibling("div")
+        if prev:
+            # Text like "-1.76 %"
+            text = prev.get_text(strip=True).replace("%", "").replace(" ", "").replace(",", ".")
+            change_percent = float(text)
     
-    # Check cache
-    cached = MOROCCAN_CACHE.get(symbol)
-    if cached and (now_ts - cached['last_fetch'] < CACHE_DURATION):
-        return cached['price'], cached['change']
+    if price <= 0:
+        raise ValueError(f"Could not parse price for {symbol}")
+    return price, change_percent
 
-    try:
-        url = f"https://www.casablancabourse.com/{target_ticker}/action/capitalisation/"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        # Verify=False to avoid SSL errors with some setups
-        response = requests.get(url, headers=headers, timeout=10, verify=False)
-        response.raise_for_status()
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        
-        # Extract Price: Look for "Prix de l'action" -> parent -> previous sibling
-        price = 0.0
-        label = soup.find(string=lambda t: "Prix de l'action" in str(t) if t else False)
-        if label:
-            parent = label.parent
-            prev = parent.find_previous_sibling("div")
-            if prev:
-                # Text like "109.10 DH"
-                text = prev.get_text(strip=True).replace("DH", "").replace(" ", "").replace(",", ".")
-                price = float(text)
-
-        # Extract Change: Look for "Change (1 jour)" -> parent -> previous sibling
-        change_percent = 0.0
-        change_label = soup.find(string=lambda t: "Change (1 jour)" in str(t) if t else False)
-        if change_label:
-            parent = change_label.parent
-            prev = parent.find_previous_sibling("div")
-            if prev:
-                # Text like "-1.76 %"
-                text = prev.get_text(strip=True).replace("%", "").replace(" ", "").replace(",", ".")
-                change_percent = float(text)
-        
-        if price > 0:
-            MOROCCAN_CACHE[symbol] = {
-                'price': price,
-                'change': change_percent,
-                'last_fetch': now_ts
-            }
-            return price, change_percent
+def _asset_class(symbol: str) -> str:
+    if symbol in MOROCCAN_SYMBOLS:
+        return "morocco"
+    if symbol in CRYPTO_SYMBOLS:
+        return "crypto"
+    return "stock"
+
+
+def _fetch_quote(symbol: str) -> tuple[float, float]:
+    if symbol in MOROCCAN_SYMBOLS:
+        try:
+            return CASABLANCA.call(symbol)
+        except Exception as e:
+            print(f"Error scraping Casablanca Bourse for {symbol}: {e}")
+            raise
+    return _get_international_price(symbol)
+
+
+def get_quote(symbol: str, max_age: float | None = None) -> tuple[float, float]:
+    """
+    Returns (price, change_percent) for any symbol, served from the shared quote cache.
+    A cached quote older than max_age seconds is refetched. Raises if the provider fails
+    and no quote has ever been cached.
+    """
+    return quote_cache.get_or_fetch(symbol, _fetch_quote, _asset_class(symbol), max_age)
+
+
+def _get_binance_prices(symbols: list[str]) -> dict[str, tuple[float, float]]:
+    # One request for every crypto symbol via the multi-symbol 24hr ticker
+    mapping = {symbol.replace("-", "").replace("USD", "USDT"): symbol for symbol in symbols}
+    url = "https://api.binance.com/api/v3/ticker/24hr"
+    response = http_client.get(url, params={"symbols": json.dumps(list(mapping), separators=(",", ":"))}, timeout=5)
+    response.raise_for_status()
+
+    quotes = {}
+    for item in response.json():
+        symbol = mapping.get(item.get("symbol"))
+        if symbol:
+            quotes[symbol] = (float(item["lastPrice"]), float(item["priceChangePercent"]))
+    return quotes
+
+
+def _get_yfinance_prices(symbols: list[str]) -> dict[str, tuple[float, float]]:
+    # One multi-ticker download; the last two daily closes give price and change
+    df = yf.download(symbols, period="5d", interval="1d", progress=False, auto_adjust=False, threads=False)
+    if df.empty:
+        return {}
+    closes = df["Close"]
+
+    quotes = {}
+    for symbol in symbols:
+        if symbol not in closes:
+            continue
+        series = closes[symbol].dropna()
+        if series.empty:
+            continue
+        current_price = float(series.iloc[-1])
+        if len(series) >= 2:
+            prev_close = float(series.iloc[-2])
+            change_percent = ((current_price - prev_close) / prev_close) * 100
         else:
-            raise ValueError(f"Could not parse price for {symbol}")
+            change_percent = 0.0
+        quotes[symbol] = (current_price, change_percent)
+    return quotes
 
-    except Exception as e:
-        print(f"Error scraping Casablanca Bourse for {symbol}: {e}")
-        # Fallback to cache if available even if expired
-        if cached:
-            return cached['price'], cached['change']
-        raise e
 
-def get_live_price(symbol: str) -> float:
+# Every upstream call goes through a Provider, which adds a circuit breaker and latency tracking
+BINANCE = Provider("binance", _get_binance_price)
+BINANCE_BULK = Provider("binance-bulk", _get_binance_prices)
+YAHOO = Provider("yfinance", _get_yfinance_price, outage_errors=(YFRateLimitError,))
+YAHOO_BULK = Provider("yfinance-bulk", _get_yfinance_prices, outage_errors=(YFRateLimitError,))
+CASABLANCA = Provider("casablanca", _get_casablanca_price)
+PROVIDERS = [BINANCE, BINANCE_BULK, YAHOO, YAHOO_BULK, CASABLANCA]
+
+
+def _fetch_quotes(symbols: list[str]) -> dict[str, tuple[float, float]]:
     """
-    Public helper to get the current price of a symbol.
-    Returns 0.0 if failed.
+    Fetches several quotes concurrently: one bulk call per provider that has a bulk
+    endpoint, then single-symbol fetches for everything else (or whatever the bulk call missed).
     """
-    try:
-        if symbol in {"IAM.PA", "ATW.PA"}:
-            price, _ = _get_casablanca_price(symbol)
+    crypto = [s for s in symbols if s in CRYPTO_SYMBOLS]
+    stocks = [s for s in symbols if s not in CRYPTO_SYMBOLS and s not in MOROCCAN_SYMBOLS]
+
+    quotes = {}
+    futures = {}
+    if crypto:
+        futures[_batch_executor.submit(BINANCE_BULK.call, crypto)] = "Binance"
+    if stocks:
+        futures[_batch_executor.submit(YAHOO_BULK.call, stocks)] = "yfinance"
+    for future in as_completed(futures):
+        try:
+            quotes.update(future.result())
+        except Exception as e:
+            print(f"{futures[future]} bulk quote error: {e}")
+
+    remaining = [s for s in symbols if s not in quotes]
+    singles = {_batch_executor.submit(_fetch_quote, s): s for s in remaining}
+    for future in as_completed(singles):
+        try:
+            quotes[singles[future]] = future.result()
+        except Exception:
+            pass
+    return quotes
+
+
+def get_quotes(symbols) -> dict[str, tuple[float, float]]:
+    """
+    Batch version of get_quote. Cached quotes are served directly and all misses are
+    fetched in one concurrent round trip. Symbols with no quote at all are omitted.
+    """
+    quotes = {}
+    to_fetch = []
+    stale = {}
+    for symbol in dict.fromkeys(symbols):
+        cached, state = quote_cache.lookup(symbol, _asset_class(symbol))
+        if state == "fresh":
+            quotes[symbol] = (cached["price"], cached["change"])
+        elif state == "stale":
+            quote_cache.refresh_in_background(symbol, _fetch_quote)
+            quotes[symbol] = (cached["price"], cached["change"])
         else:
-            price, _ = _get_international_price(symbol)
-        return price
-    except Exception:
-        return 0.0
+            to_fetch.append(symbol)
+            if cached:
+                stale[symbol] = (cached["price"], cached["change"])
+
+    if to_fetch:
+        fetched = _fetch_quotes(to_fetch)
+        for symbol in to_fetch:
+            if symbol in fetched:
+                price, change = fetched[symbol]
+                quote_cache.put(symbol, price, change)
+                quotes[symbol] = (price, change)
+            elif symbol in stale:
+                quotes[symbol] = stale[symbol]
+    return quotes
+
 
 @market_bp.route("/price/<symbol>", methods=["GET"])
 def get_price(symbol: str):
-    try:
-        if symbol in {"IAM.PA", "ATW.PA"}:
-            price, change_percent = _get_casablanca_price(symbol)
-        else:
-            price, change_percent = _get_international_price(symbol)
-    except Exception as exc:
-        return jsonify({"message": "Unable to fetch market price.", "error": str(exc)}), 502
+    market_poller.track(symbol)
+
+    # With the poller running, serve whatever the store holds; it is refreshed in the background.
+    entry = quote_cache.get(symbol) if market_poller.is_running() else None
+    if entry is None:
+        try:
+            get_quote(symbol)
+        except Exception as exc:
+            return jsonify({"message": "Unable to fetch market price.", "error": str(exc)}), 502
+        entry = quote_cache.get(symbol)
 
     now = datetime.now(timezone.utc)
+    age = max(0.0, now.timestamp() - entry["fetched_at"])
     return jsonify(
         {
             "symbol": symbol,
-            "price": price,
-            "changePercent": change_percent,
+            "price": entry["price"],
+            "changePercent": entry["change"],
             "timestamp": int(now.timestamp()),
+            "quoteTimestamp": int(entry["fetched_at"]),
+            "ageSeconds": round(age, 1),
+            "stale": age > quote_cache.ttl_for(_asset_class(symbol)),
         }
     )
 
 
-import random
+@market_bp.route("/providers", methods=["GET"])
+def get_provider_status():
+    return jsonify({"providers": [provider.status() for provider in PROVIDERS]})
+
 
 @market_bp.route("/chart/<symbol>", methods=["GET"])
 def get_chart_data(symbol: str):
-    try:
-        # Moroccan Stocks
-        if symbol in {"IAM.PA", "ATW.PA"}:
-            # Since we don't have historical data source for Moroccan stocks yet,
-            # we'll return a single candle based on current price to initialize.
-            # Frontend will accumulate real-time updates.
-            price, _ = _get_casablanca_price(symbol)
-            now = int(datetime.now(timezone.utc).timestamp())
-            
-            # Generate 100 fake candles for the last ~8 hours (5 min interval)
-            # Generated BACKWARDS from current price to ensure smoothness
-            chart_data = []
-            volatility = 0.002 # 0.2% volatility per candle
-            
-            current_close = price
-            
-            # We generate from newest to oldest, then reverse
-            for i in range(100):
-                t = now - i * 300
-                
-                # Random movement
-                change_percent = (random.random() - 0.5) * volatility
-                open_p = current_close / (1 + change_percent)
-                
-                # High/Low logic
-                high_p = max(open_p, current_close) * (1 + random.random() * volatility * 0.5)
-                low_p = min(open_p, current_close) * (1 - random.random() * volatility * 0.5)
-                
-                chart_data.append({
-                    "time": t,
-                    "open": float(f"{open_p:.2f}"),
-                    "high": float(f"{high_p:.2f}"),
-                    "low": float(f"{low_p:.2f}"),
-                    "close": float(f"{current_close:.2f}")
-                })
-                
-                # Next candle's close (which is this candle's open)
-                current_close = open_p
-
-            # Reverse to get chronological order
-            chart_data.reverse()
-            return jsonify(chart_data)
+    interval = request.args.get("interval", "1m")
+    if interval not in INTERVAL_SECONDS:
+        return jsonify({"message": f"Unsupported interval. Use one of: {', '.join(INTERVAL_SECONDS)}."}), 400
+    max_points = min(request.args.get("maxPoints", MAX_CHART_POINTS, type=int), MAX_CHART_POINTS)
 
-        # International Stocks
-        ticker = yf.Ticker(symbol)
-        # Fetch 1 day of 1-minute intervals for "Professional Live" look
-        df = ticker.history(period="1d", interval="1m", auto_adjust=True)
-        
-        # Fallback if intraday is empty
-        if df.empty:
-            df = ticker.history(period="5d", interval="5m", auto_adjust=True)
-
-        chart_data = []
-        for index, row in df.iterrows():
-            # index is the timestamp
-            ts = int(index.timestamp())
-            chart_data.append({
-                "time": ts,
-                "open": float(row["Open"]),
-                "high": float(row["High"]),
-                "low": float(row["Low"]),
-                "close": float(row["Close"])
-            })
+    try:
+        market_poller.track(symbol)
+        source = "1m"
+
+        if symbol in MOROCCAN_SYMBOLS:
+            # No historical data source for Moroccan stocks: a deterministic synthetic
+            # history backfills short series, which grow with real scraped prices.
+            price, _ = get_quote(symbol)
+            synthetic_candles.ensure_history(symbol, price)
+            if not market_poller.is_running():
+                candle_store.record_tick(symbol, price)
+        else:
+            # International Stocks
+            # Served from the local candle store; a refresh only fetches bars newer than the last stored one.
+            # With the poller running, stored series are kept current in the background.
+            if not market_poller.is_running() or candle_store.last_timestamp(symbol, "1m") is None:
+                candle_store.refresh_if_due(symbol, "1m")
+
+            # Fallback if intraday is empty
+            if candle_store.last_timestamp(symbol, "1m") is None:
+                candle_store.refresh_if_due(symbol, "5m")
+                source = "5m"
+
+        step = max(INTERVAL_SECONDS[interval], INTERVAL_SECONDS[source])
+        end = request.args.get("to", type=int) or candle_store.last_timestamp(symbol, source)
+        start = request.args.get("from", type=int)
+        if start is None and end is not None:
+            start = end - DEFAULT_CHART_SPAN[interval]
+
+        candles = candle_store.get_columns(symbol, source, start=start, end=end)
+        if step > INTERVAL_SECONDS[source]:
+            candles = candle_aggregation.resample(candles, step)
+        candles = candle_aggregation.downsample(candles, max_points)
+
+        chart_data = candle_store.to_payload(candles, request.args.get("format", "rows"))
 
         return jsonify(chart_data)
 
@@ -295,56 +387,59 @@ def get_chart_data(symbol: str):
         return jsonify({"message": "Unable to fetch chart data.", "error": str(e)}), 500
 
 
+def _signal_from_rsi(current_rsi: float) -> dict:
+    if current_rsi < 30:
+        signal = "BUY"
+        confidence = min(int((30 - current_rsi) * 2 + 60), 95) # 30->60%, 10->100%
+        reason_key = "ai_signal_rsi_oversold"
+    elif current_rsi > 70:
+        signal = "SELL"
+        confidence = min(int((current_rsi - 70) * 2 + 60), 95)
+        reason_key = "ai_signal_rsi_overbought"
+    else:
+        signal = "HOLD"
+        confidence = int(100 - abs(50 - current_rsi)) # 50 -> 100%, 30/70 -> 80%
+        reason_key = "ai_signal_rsi_neutral"
+
+    return {
+        "signal": signal,
+        "confidence": confidence,
+        "reasonKey": reason_key,
+    }
+
+
 @market_bp.route("/signal/<symbol>", methods=["GET"])
 def get_ai_signal(symbol: str):
     try:
         # Mock signal for Moroccan stocks or if data fails
-        if symbol in {"IAM.PA", "ATW.PA"}:
+        if symbol in MOROCCAN_SYMBOLS:
             return jsonify({
                 "signal": "HOLD",
                 "confidence": 50,
                 "reasonKey": "ai_signal_hold_reason" 
             })
 
-        # Fetch data for Technical Analysis
-        ticker = yf.Ticker(symbol)
-        df = ticker.history(period="1mo", interval="1d")
-        
-        if len(df) < 15:
+        requested = [
+            name.strip().lower()
+            for name in (request.args.get("indicators") or "rsi").split(",")
+            if name.strip().lower() in INDICATORS
+        ]
+
+        # Indicators are kept incrementally per symbol and cached until the next daily bar closes
+        market_poller.track(symbol)
+        bar_count, values = indicator_engine.get(symbol)
+        current_rsi = values["rsi"]
+
+        if bar_count < 15 or current_rsi is None:
              return jsonify({
                 "signal": "HOLD",
                 "confidence": 50,
                 "reasonKey": "ai_signal_insufficient_data" 
             })
-
-        # Calculate RSI (14)
-        delta = df["Close"].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        
-        current_rsi = rsi.iloc[-1]
         
-        # Determine Signal
-        if current_rsi < 30:
-            signal = "BUY"
-            confidence = min(int((30 - current_rsi) * 2 + 60), 95) # 30->60%, 10->100%
-            reason_key = "ai_signal_rsi_oversold"
-        elif current_rsi > 70:
-            signal = "SELL"
-            confidence = min(int((current_rsi - 70) * 2 + 60), 95)
-            reason_key = "ai_signal_rsi_overbought"
-        else:
-            signal = "HOLD"
-            confidence = int(100 - abs(50 - current_rsi)) # 50 -> 100%, 30/70 -> 80%
-            reason_key = "ai_signal_rsi_neutral"
-
-        return jsonify({
-            "signal": signal,
-            "confidence": confidence,
-            "reasonKey": reason_key
-        })
+        payload = _signal_from_rsi(current_rsi)
+        payload["indicators"] = {name: values[name] for name in requested}
+        return jsonify(payload)
 
     except Exception as e:
         print(f"Signal error: {e}")
@@ -354,3 +449,41 @@ def get_ai_signal(symbol: str):
             "reasonKey": "ai_signal_error_fallback"
         })
 
+
+@market_bp.route("/signals", methods=["POST"])
+def get_ai_signals():
+    data = request.get_json() or {}
+    symbols = list(dict.fromkeys(str(s).strip().upper() for s in (data.get("symbols") or []) if str(s).strip()))
+
+    if not symbols:
+        return jsonify({"message": "symbols must be a non-empty list."}), 400
+    if len(symbols) > MAX_SIGNAL_SYMBOLS:
+        return jsonify({"message": f"At most {MAX_SIGNAL_SYMBOLS} symbols per request."}), 400
+
+    signals = {}
+    for symbol in symbols:
+        if symbol in MOROCCAN_SYMBOLS:
+            signals[symbol] = {"signal": "HOLD", "confidence": 50, "reasonKey": "ai_signal_hold_reason"}
+
+    international = [s for s in symbols if s not in MOROCCAN_SYMBOLS]
+    if international:
+        try:
+            # One bulk download for the whole watchlist; only closed daily bars are used
+            df = yf.download(international, period="3mo", interval="1d", progress=False, auto_adjust=True, threads=False)
+            closes = df["Close"].reindex(columns=international)
+            index = closes.index.tz_convert(None) if closes.index.tz is not None else closes.index
+            today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+            closes = closes[index < today]
+
+            rsi, counts = wilder_rsi_matrix(closes.to_numpy(dtype=float).T)
+            for symbol, value, count in zip(international, rsi.tolist(), counts.tolist()):
+                if count < 15 or value != value:  # NaN
+                    signals[symbol] = {"signal": "HOLD", "confidence": 50, "reasonKey": "ai_signal_insufficient_data"}
+                else:
+                    signals[symbol] = _signal_from_rsi(value)
+        except Exception as e:
+            print(f"Batch signal error: {e}")
+            for symbol in international:
+                signals[symbol] = {"signal": "HOLD", "confidence": 50, "reasonKey": "ai_signal_error_fallback"}
+
+    return jsonify({"signals": {symbol: signals[symbol] for symbol in symbols}})
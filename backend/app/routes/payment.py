@@ -1,13 +1,25 @@
 from flask import Blueprint, jsonify, redirect, request
 from flask_jwt_extended import get_jwt_identity, jwt_required
 
-from app import db
+from sqlalchemy.exc import IntegrityError
+
+from app import db, http_client
+from app.jobs import job_queue
 from app.models import Challenge, Payment, PayPalConfig
+from app.rule_sets import rule_set_for
+
+import os
+import threading
+import time
 
 import requests
 
 payment_bp = Blueprint("payment", __name__)
 
+# { (client_id, mode): (access_token, expires_at_monotonic) }
+PAYPAL_TOKEN_CACHE = {}
+PAYPAL_TOKEN_REFRESH_MARGIN = 300  # refresh 5 minutes before PayPal expires the token
+_paypal_token_lock = threading.Lock()
 
 
 def _get_current_user_id():
@@ -16,15 +28,19 @@ def _get_current_user_id():
 
 
 def _get_paypal_api_base(config: PayPalConfig) -> str:
+    # PAYPAL_API_BASE points the integration at a local PayPal stand-in
+    override = os.environ.get("PAYPAL_API_BASE")
+    if override:
+        return override.rstrip("/")
     mode = (config.mode or "").lower()
     if mode == "live":
         return "https://api-m.paypal.com"
     return "https://api-m.sandbox.paypal.com"
 
 
-def _get_paypal_access_token(config: PayPalConfig) -> str:
+def _request_paypal_access_token(config: PayPalConfig) -> tuple[str, float]:
     base = _get_paypal_api_base(config)
-    response = requests.post(
+    response = http_client.post(
         f"{base}/v1/oauth2/token",
         data={"grant_type": "client_credentials"},
         auth=(config.client_id, config.client_secret),
@@ -35,7 +51,33 @@ def _get_paypal_access_token(config: PayPalConfig) -> str:
     token = data.get("access_token")
     if not token:
         raise RuntimeError("Missing PayPal access token")
-    return token
+    expires_in = float(data.get("expires_in") or 0)
+    return token, time.monotonic() + expires_in
+
+
+def _get_paypal_access_token(config: PayPalConfig) -> str:
+    """
+    Returns a cached OAuth token for (client_id, mode), requesting a new one only when
+    the cached token is within PAYPAL_TOKEN_REFRESH_MARGIN seconds of expiring.
+    """
+    key = (config.client_id, (config.mode or "").lower())
+    cached = PAYPAL_TOKEN_CACHE.get(key)
+    if cached and time.monotonic() < cached[1] - PAYPAL_TOKEN_REFRESH_MARGIN:
+        return cached[0]
+
+    # One refresh at a time; threads that waited reuse the token just fetched
+    with _paypal_token_lock:
+        cached = PAYPAL_TOKEN_CACHE.get(key)
+        if cached and time.monotonic() < cached[1] - PAYPAL_TOKEN_REFRESH_MARGIN:
+            return cached[0]
+        token, expires_at = _request_paypal_access_token(config)
+        PAYPAL_TOKEN_CACHE[key] = (token, expires_at)
+        return token
+
+
+def invalidate_paypal_token_cache() -> None:
+    with _paypal_token_lock:
+        PAYPAL_TOKEN_CACHE.clear()
 
 
 def _create_paypal_order(
@@ -71,7 +113,7 @@ def _create_paypal_order(
             "cancel_url": cancel_url,
         },
     }
-    response = requests.post(
+    response = http_client.post(
         f"{base}/v2/checkout/orders",
         json=body,
         headers=headers,
@@ -221,9 +263,7 @@ def checkout():
         starting_balance=starting_balance,
         current_balance=starting_balance,
         current_equity=starting_balance,
-        profit_target=10.0,
-        max_daily_loss_pct=5.0,
-        max_total_loss_pct=10.0,
+        **rule_set_for(plan_name).challenge_columns(),
     )
     db.session.add(challenge)
 
@@ -276,48 +316,34 @@ def payment_history():
     return jsonify({"payments": payload})
 
 
-@payment_bp.route("/paypal/success", methods=["GET"])
-def paypal_success():
-    token = (request.args.get("token") or "").strip()
-    if not token:
-        return redirect("/dashboard")
-
-    config = PayPalConfig.query.first()
-    if not config:
-        return redirect("/dashboard")
-
-    try:
-        access_token = _get_paypal_access_token(config)
-        base = _get_paypal_api_base(config)
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
-        response = requests.post(
-            f"{base}/v2/checkout/orders/{token}/capture",
-            headers=headers,
-            timeout=10,
-        )
-        response.raise_for_status()
-        data = response.json()
-    except Exception:
-        return redirect("/dashboard")
+def _paypal_headers(config: PayPalConfig) -> dict:
+    return {
+        "Authorization": f"Bearer {_get_paypal_access_token(config)}",
+        "Content-Type": "application/json",
+    }
 
-    if data.get("status") != "COMPLETED":
-        return redirect("/dashboard")
 
-    purchase_units = data.get("purchase_units") or []
-    if not purchase_units:
-        return redirect("/dashboard")
+def _capture_paypal_order(config: PayPalConfig, order_id: str) -> dict:
+    base = _get_paypal_api_base(config)
+    headers = _paypal_headers(config)
+    # PayPal-Request-Id makes a retried capture return the original result instead of failing
+    headers["PayPal-Request-Id"] = f"capture-{order_id}"
+    response = http_client.post(
+        f"{base}/v2/checkout/orders/{order_id}/capture",
+        headers=headers,
+        timeout=10,
+    )
+    if response.status_code == 422:
+        # Already captured (e.g. by the webhook path): read the order instead
+        response = http_client.get(f"{base}/v2/checkout/orders/{order_id}", headers=headers, timeout=10)
+    response.raise_for_status()
+    return response.json()
 
-    unit = purchase_units[0]
-    custom_id = (unit.get("custom_id") or "").strip()
-    amount_info = unit.get("amount") or {}
-    amount_value = float(amount_info.get("value") or 0)
 
+def _parse_custom_id(custom_id: str):
     user_id = None
     plan_name = None
-    for part in custom_id.split("|"):
+    for part in (custom_id or "").strip().split("|"):
         if part.startswith("user:"):
             raw = part.split(":", 1)[1]
             try:
@@ -326,13 +352,26 @@ def paypal_success():
                 user_id = None
         elif part.startswith("plan:"):
             plan_name = part.split(":", 1)[1]
+    return user_id, plan_name
+
 
+def fulfill_paypal_order(order_id: str, custom_id: str, amount_value: float) -> None:
+    """
+    Creates the Payment and Challenge for a captured PayPal order. Idempotent: the
+    Payment row is keyed by the PayPal order ID, so redirects, webhook deliveries and
+    job retries for the same order fulfill it at most once.
+    """
+    if Payment.query.filter_by(provider_order_id=order_id).first():
+        return
+
+    user_id, plan_name = _parse_custom_id(custom_id)
     if not user_id or not plan_name:
-        return redirect("/dashboard")
+        print(f"PayPal order {order_id} has no usable custom_id: {custom_id!r}")
+        return
 
     existing = Challenge.query.filter_by(user_id=user_id, status="ACTIVE").first()
     if existing:
-        return redirect("/dashboard")
+        return
 
     if plan_name == "Starter":
         starting_balance = 5000.0
@@ -349,6 +388,7 @@ def paypal_success():
         amount=amount_value,
         currency="DH",
         status="completed",
+        provider_order_id=order_id,
     )
     db.session.add(payment)
 
@@ -359,17 +399,108 @@ def paypal_success():
         starting_balance=starting_balance,
         current_balance=starting_balance,
         current_equity=starting_balance,
-        profit_target=10.0,
-        max_daily_loss_pct=5.0,
-        max_total_loss_pct=10.0,
+        **rule_set_for(plan_name).challenge_columns(),
     )
     db.session.add(challenge)
 
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent fulfillment of the same order won the unique provider_order_id
+        db.session.rollback()
+
+
+def capture_and_fulfill_paypal_order(order_id: str) -> None:
+    """
+    Background job: captures an approved order and fulfills it. Raises on transient
+    PayPal errors so the job queue retries it.
+    """
+    if Payment.query.filter_by(provider_order_id=order_id).first():
+        return
+
+    config = PayPalConfig.query.first()
+    if not config:
+        return
+
+    data = _capture_paypal_order(config, order_id)
+    if data.get("status") != "COMPLETED":
+        return
 
+    purchase_units = data.get("purchase_units") or []
+    if not purchase_units:
+        return
+
+    unit = purchase_units[0]
+    captures = (unit.get("payments") or {}).get("captures") or [{}]
+    custom_id = unit.get("custom_id") or captures[0].get("custom_id") or ""
+    amount_info = unit.get("amount") or captures[0].get("amount") or {}
+    fulfill_paypal_order(order_id, custom_id, float(amount_info.get("value") or 0))
+
+
+def _verify_paypal_webhook(config: PayPalConfig, event: dict, webhook_id: str) -> bool:
+    body = {
+        "auth_algo": request.headers.get("PAYPAL-AUTH-ALGO"),
+        "cert_url": request.headers.get("PAYPAL-CERT-URL"),
+        "transmission_id": request.headers.get("PAYPAL-TRANSMISSION-ID"),
+        "transmission_sig": request.headers.get("PAYPAL-TRANSMISSION-SIG"),
+        "transmission_time": request.headers.get("PAYPAL-TRANSMISSION-TIME"),
+        "webhook_id": webhook_id,
+        "webhook_event": event,
+    }
+    response = http_client.post(
+        f"{_get_paypal_api_base(config)}/v1/notifications/verify-webhook-signature",
+        json=body,
+        headers=_paypal_headers(config),
+        timeout=10,
+    )
+    return response.ok and response.json().get("verification_status") == "SUCCESS"
+
+
+@payment_bp.route("/paypal/success", methods=["GET"])
+def paypal_success():
+    token = (request.args.get("token") or "").strip()
+    if token:
+        # Capture happens on the job queue; the user is redirected right away
+        job_queue.enqueue(capture_and_fulfill_paypal_order, token, key=("paypal-capture", token))
     return redirect("/dashboard")
 
 
+@payment_bp.route("/paypal/webhook", methods=["POST"])
+def paypal_webhook():
+    event = request.get_json(silent=True) or {}
+    config = PayPalConfig.query.first()
+    if not config:
+        return jsonify({"message": "PayPal is not configured."}), 400
+
+    # Events can only be verified against a webhook registered with PayPal; unverifiable
+    # events are refused rather than trusted
+    webhook_id = os.environ.get("PAYPAL_WEBHOOK_ID")
+    if not webhook_id:
+        return jsonify({"message": "Webhook verification is not configured."}), 403
+
+    try:
+        verified = _verify_paypal_webhook(config, event, webhook_id)
+    except Exception as exc:
+        return jsonify({"message": "Unable to verify webhook.", "error": str(exc)}), 502
+    if not verified:
+        return jsonify({"message": "Invalid webhook signature."}), 400
+
+    event_type = event.get("event_type")
+    resource = event.get("resource") or {}
+
+    if event_type == "CHECKOUT.ORDER.APPROVED" and resource.get("id"):
+        order_id = resource["id"]
+        job_queue.enqueue(capture_and_fulfill_paypal_order, order_id, key=("paypal-capture", order_id))
+    elif event_type == "PAYMENT.CAPTURE.COMPLETED":
+        order_id = ((resource.get("supplementary_data") or {}).get("related_ids") or {}).get("order_id")
+        if order_id:
+            # Status, custom_id and amount are read back from PayPal, never from the payload
+            job_queue.enqueue(capture_and_fulfill_paypal_order, order_id, key=("paypal-capture", order_id))
+
+    # Acknowledge every event so PayPal stops redelivering it
+    return jsonify({"received": True})
+
+
 @payment_bp.route("/paypal/cancel", methods=["GET"])
 def paypal_cancel():
     return redirect("/challenges")
@@ -4,17 +4,108 @@ from flask import Blueprint, jsonify, request
 from flask_jwt_extended import get_jwt_identity, jwt_required
 
 from app import db
-from app.models import Challenge, Trade, Position
-from app.routes.market import get_live_price
+from app.execution import OrderRejected, execute_batch, execute_fill, market_fill_price
+from app.models import Challenge, PortfolioSnapshot, RestingOrder, Trade
+from app.order_book import ORDER_TYPES, cancel_order, fills_at, place_oco, place_order, required_prices
+from app.portfolio import load_snapshot, serialize_snapshot
+from app.routes.market import get_quotes
 
 trade_bp = Blueprint("trade", __name__)
 
+MAX_BATCH_ORDERS = 100
+MAX_OPEN_ORDERS = 200  # per challenge
+
 
 def _get_current_user_id():
     identity = get_jwt_identity()
     return int(identity) if identity is not None else None
 
 
+def _parse_price(data: dict, key: str):
+    return float(data[key]) if data.get(key) is not None else None
+
+
+def _parse_resting_order(data: dict):
+    """
+    Validates a resting order payload. Returns (fields, None) or (None, error message).
+    """
+    symbol = (data.get("symbol") or "").upper()
+    side = (data.get("side") or "").upper()
+    order_type = (data.get("orderType") or "").upper()
+    try:
+        quantity = float(data.get("quantity") or 0)
+        limit_price = _parse_price(data, "limitPrice")
+        stop_price = _parse_price(data, "stopPrice")
+    except (TypeError, ValueError):
+        return None, "Invalid numeric values."
+
+    if not symbol or side not in {"BUY", "SELL"}:
+        return None, "Invalid order payload."
+    if order_type not in ORDER_TYPES:
+        return None, "Unsupported order type."
+    if quantity <= 0:
+        return None, "Quantity must be positive."
+    prices = {"limitPrice": limit_price, "stopPrice": stop_price}
+    for key in required_prices(order_type):
+        if prices[key] is None or prices[key] <= 0:
+            return None, f"{order_type} orders require a positive {key}."
+
+    return {
+        "symbol": symbol,
+        "side": side,
+        "order_type": order_type,
+        "quantity": quantity,
+        "limit_price": limit_price,
+        "stop_price": stop_price,
+    }, None
+
+
+def _serialize_order(order: RestingOrder) -> dict:
+    return {
+        "id": order.id,
+        "challengeId": order.challenge_id,
+        "symbol": order.symbol,
+        "side": order.side,
+        "orderType": order.order_type,
+        "quantity": order.quantity,
+        "limitPrice": order.limit_price,
+        "stopPrice": order.stop_price,
+        "ocoGroup": order.oco_group,
+        "status": order.status,
+        "message": order.message,
+        "triggered": order.triggered_at is not None,
+        "fillPrice": order.fill_price,
+        "tradeId": order.trade_id,
+        "createdAt": order.created_at.isoformat() if order.created_at else None,
+        "filledAt": order.filled_at.isoformat() if order.filled_at else None,
+    }
+
+
+def _open_order_limit(challenge_id):
+    """
+    Returns (response, status) if the challenge already has MAX_OPEN_ORDERS open orders, else None.
+    """
+    open_orders = RestingOrder.query.filter_by(challenge_id=challenge_id, status="OPEN").count()
+    if open_orders >= MAX_OPEN_ORDERS:
+        return jsonify({"message": f"At most {MAX_OPEN_ORDERS} open orders per challenge."}), 400
+    return None
+
+
+def _active_challenge_for(user_id, challenge_id):
+    """
+    Returns (challenge, None) or (None, (response, status)).
+    """
+    challenge = Challenge.query.filter_by(id=challenge_id, user_id=user_id).first()
+    if not challenge:
+        return None, (jsonify({"message": "Challenge not found."}), 404)
+    if challenge.status != "ACTIVE":
+        return None, (jsonify({"message": "Challenge is not active."}), 400)
+    failure = _open_order_limit(challenge.id)
+    if failure:
+        return None, failure
+    return challenge, None
+
+
 def _today_bounds():
     now = datetime.now(timezone.utc)
     start = datetime(year=now.year, month=now.month, day=now.day, tzinfo=timezone.utc)
@@ -78,19 +169,32 @@ def execute_trade():
     challenge_id = data.get("challengeId")
     symbol = (data.get("symbol") or "").upper()
     side = (data.get("side") or "").upper()
+    order_type = (data.get("orderType") or "MARKET").upper()
 
+    # price/pnl from the client are ignored: fills are priced server-side from the quote cache
     try:
         quantity = float(data.get("quantity") or 0)
-        price = float(data.get("price") or 0)
-        pnl = float(data.get("pnl") or 0)
+        limit_price = _parse_price(data, "limitPrice")
+        stop_price = _parse_price(data, "stopPrice")
     except (TypeError, ValueError):
         return jsonify({"message": "Invalid numeric values."}), 400
 
     if not challenge_id or not symbol or side not in {"BUY", "SELL"}:
         return jsonify({"message": "Invalid trade payload."}), 400
 
-    if quantity <= 0 or price <= 0:
-        return jsonify({"message": "Quantity and price must be positive."}), 400
+    if order_type != "MARKET" and order_type not in ORDER_TYPES:
+        return jsonify({"message": "Unsupported order type."}), 400
+
+    # Without their trigger prices, limit-style orders keep filling at market as before
+    if order_type == "STOP_LIMIT" and stop_price is None:
+        order_type = "LIMIT"
+    if order_type in {"LIMIT", "TAKE_PROFIT"} and limit_price is None:
+        order_type = "MARKET"
+    if order_type == "STOP" and stop_price is None:
+        return jsonify({"message": "STOP orders require a stopPrice."}), 400
+
+    if quantity <= 0:
+        return jsonify({"message": "Quantity must be positive."}), 400
 
     challenge = Challenge.query.filter_by(id=challenge_id, user_id=user_id).first()
     if not challenge:
@@ -99,108 +203,183 @@ def execute_trade():
     if challenge.status != "ACTIVE":
         return jsonify({"message": "Challenge is not active."}), 400
 
-    # Server-side Portfolio Logic
-    # Binance-style: Cash is a Position (USD)
-    # 1. Get/Create USD Position
-    usd_pos = Position.query.filter_by(challenge_id=challenge.id, symbol="USD").first()
-    if not usd_pos:
-        # Migration: If no USD position, assume current_balance is the initial cash
-        usd_pos = Position(
-            challenge_id=challenge.id,
-            symbol="USD",
-            quantity=challenge.current_balance,
-            avg_price=1.0
-        )
-        db.session.add(usd_pos)
-        # Flush to get ID if needed, though mostly we just need object
-        db.session.flush()
-
-    cost = price * quantity
-    
-    if side == "BUY":
-        # Check USD Position for liquidity
-        if usd_pos.quantity < cost:
-            return jsonify({"message": "Insufficient buying power."}), 400
-        
-        # Deduct from USD Position
-        usd_pos.quantity -= cost
-        
-        # Update/Create Asset Position
-        pos = Position.query.filter_by(challenge_id=challenge.id, symbol=symbol).first()
-        if pos:
-            new_qty = pos.quantity + quantity
-            # Weighted average price
-            new_avg = ((pos.quantity * pos.avg_price) + cost) / new_qty
-            pos.quantity = new_qty
-            pos.avg_price = new_avg
-        else:
-            pos = Position(
-                challenge_id=challenge.id, 
-                symbol=symbol, 
-                quantity=quantity, 
-                avg_price=price
-            )
-            db.session.add(pos)
-            
-    elif side == "SELL":
-        pos = Position.query.filter_by(challenge_id=challenge.id, symbol=symbol).first()
-        if not pos or pos.quantity < quantity:
-            return jsonify({"message": "Not enough shares to sell."}), 400
-            
-        # Add to USD Position
-        usd_pos.quantity += cost
-        
-        # Reduce Asset Position
-        pos.quantity -= quantity
-        
-        # Calculate realized PnL for this trade (for stats only)
-        # (Sell Price - Avg Buy Price) * Quantity
-        realized_pnl = (price - pos.avg_price) * quantity
-        pnl = realized_pnl  
-        
-        if pos.quantity < 0.000001: # Float epsilon
-            db.session.delete(pos)
-
-    # NOTE: challenge.current_balance is NOT manually updated with profit/loss here.
-    # It will be updated to reflect Total Equity (Sum of all positions) 
-    # either here or by the periodic evaluator.
-    # For now, let's update it to be the Total Equity so the UI is consistent.
-    
-    # We need to sum all positions. Since we are in a transaction, we should query existing + current changes.
-    # However, for simplicity and performance, we can just update the `current_balance` 
-    # to be the "Estimated Total Value" using the provided price for the traded asset 
-    # and assuming other assets haven't moved in this split second.
-    # BUT, to be safe and accurate to the user request ("Balance updates automatically"),
-    # we should let the frontend/portfolio endpoint handle the total calculation,
-    # OR we update the cached value here.
-    
-    # Let's update `current_balance` to be the USD quantity (Cash) + Asset Value?
-    # No, user said "Do not directly change the balance number".
-    # This implies we leave `current_balance` alone or use it as Total Equity.
-    # If we use it as Total Equity, it doesn't change on Buy (swap USD->Asset).
-    # It only changes on price movement.
-    # So strictly speaking, on Buy/Sell, Total Equity stays roughly same (minus spread/fees).
-    # So we DO NOT touch challenge.current_balance here.
-
-    trade = Trade(
-        challenge_id=challenge_id,
-        symbol=symbol,
-        side=side,
-        quantity=quantity,
-        price=price,
-        pnl=pnl,
-    )
-
-    db.session.add(trade)
-    db.session.commit()
+    # Server-side Portfolio Logic: the execution engine applies the fill atomically
+    try:
+        price = market_fill_price(symbol, side)
+        if not fills_at(order_type, side, price, limit_price, stop_price):
+            # Not marketable yet: rest the order in the book until the price gets there
+            failure = _open_order_limit(challenge.id)
+            if failure:
+                return failure
+            order = place_order(challenge.id, symbol, side, quantity, order_type, limit_price, stop_price)
+            return jsonify({"message": "Order placed.", "order": _serialize_order(order)}), 202
+        result = execute_fill(challenge.id, symbol, side, quantity, price)
+    except OrderRejected as exc:
+        return jsonify({"message": exc.message}), exc.status
 
     return jsonify({
         "message": "Trade executed.", 
-        "tradeId": trade.id,
-        "newCashBalance": usd_pos.quantity # Return USD qty as cash balance
+        "tradeId": result["trade"].id,
+        "fillPrice": result["trade"].price,
+        "newCashBalance": result["cash"] # Return USD qty as cash balance
+    }), 201
+
+
+@trade_bp.route("/execute-batch", methods=["POST"])
+@jwt_required()
+def execute_trade_batch():
+    user_id = _get_current_user_id()
+    if not user_id:
+        return jsonify({"message": "Unauthorized"}), 401
+
+    data = request.get_json() or {}
+    challenge_id = data.get("challengeId")
+    raw_orders = data.get("orders")
+
+    if not challenge_id or not isinstance(raw_orders, list) or not raw_orders:
+        return jsonify({"message": "challengeId and a non-empty orders list are required."}), 400
+
+    if len(raw_orders) > MAX_BATCH_ORDERS:
+        return jsonify({"message": f"At most {MAX_BATCH_ORDERS} orders per batch."}), 400
+
+    orders = []
+    for index, raw in enumerate(raw_orders):
+        raw = raw if isinstance(raw, dict) else {}
+        symbol = (raw.get("symbol") or "").upper()
+        side = (raw.get("side") or "").upper()
+        order_type = (raw.get("orderType") or "MARKET").upper()
+        try:
+            quantity = float(raw.get("quantity") or 0)
+            limit_price = _parse_price(raw, "limitPrice")
+            stop_price = _parse_price(raw, "stopPrice")
+        except (TypeError, ValueError):
+            return jsonify({"message": f"Invalid numeric values in order {index}."}), 400
+        if not symbol or side not in {"BUY", "SELL"} or order_type not in {"MARKET", "LIMIT", "STOP_LIMIT"} or quantity <= 0:
+            return jsonify({"message": f"Invalid order at index {index}."}), 400
+        # Batches fill or reject immediately, so a STOP_LIMIT needs both of its prices
+        if order_type == "STOP_LIMIT" and (stop_price is None or limit_price is None):
+            return jsonify({"message": f"STOP_LIMIT order at index {index} requires stopPrice and limitPrice."}), 400
+        if order_type == "LIMIT" and limit_price is None:
+            order_type = "MARKET"
+        orders.append({
+            "symbol": symbol,
+            "side": side,
+            "orderType": order_type,
+            "quantity": quantity,
+            "limitPrice": limit_price,
+            "stopPrice": stop_price,
+        })
+
+    challenge = Challenge.query.filter_by(id=challenge_id, user_id=user_id).first()
+    if not challenge:
+        return jsonify({"message": "Challenge not found."}), 404
+
+    if challenge.status != "ACTIVE":
+        return jsonify({"message": "Challenge is not active."}), 400
+
+    # Warm the quote cache for every symbol in one round trip before filling
+    get_quotes([order["symbol"] for order in orders])
+
+    try:
+        results = execute_batch(challenge.id, orders)
+    except OrderRejected as exc:
+        return jsonify({"message": exc.message}), exc.status
+
+    return jsonify({
+        "message": "Batch processed.",
+        "results": results,
+        "filled": sum(1 for r in results if r["status"] == "FILLED"),
     }), 201
 
 
+@trade_bp.route("/orders", methods=["POST"])
+@jwt_required()
+def create_order():
+    """
+    Places a resting LIMIT, STOP, TAKE_PROFIT or STOP_LIMIT order. With an "oco" list
+    of legs instead, places them as one-cancels-other orders.
+    """
+    user_id = _get_current_user_id()
+    if not user_id:
+        return jsonify({"message": "Unauthorized"}), 401
+
+    data = request.get_json() or {}
+    challenge_id = data.get("challengeId")
+    if not challenge_id:
+        return jsonify({"message": "challengeId is required."}), 400
+
+    legs = data.get("oco")
+    if legs is not None:
+        if not isinstance(legs, list) or len(legs) < 2:
+            return jsonify({"message": "OCO orders need at least two legs."}), 400
+        parsed = []
+        for leg in legs:
+            fields, error = _parse_resting_order(leg if isinstance(leg, dict) else {})
+            if error:
+                return jsonify({"message": error}), 400
+            parsed.append(fields)
+        if len({leg["symbol"] for leg in parsed}) != 1:
+            return jsonify({"message": "OCO legs must share one symbol."}), 400
+    else:
+        fields, error = _parse_resting_order(data)
+        if error:
+            return jsonify({"message": error}), 400
+
+    challenge, failure = _active_challenge_for(user_id, challenge_id)
+    if failure:
+        return failure
+
+    if legs is not None:
+        orders = place_oco(challenge.id, parsed)
+        return jsonify({"message": "Orders placed.", "orders": [_serialize_order(o) for o in orders]}), 201
+
+    order = place_order(challenge.id, **fields)
+    return jsonify({"message": "Order placed.", "order": _serialize_order(order)}), 201
+
+
+@trade_bp.route("/orders", methods=["GET"])
+@jwt_required()
+def list_orders():
+    user_id = _get_current_user_id()
+    if not user_id:
+        return jsonify({"message": "Unauthorized"}), 401
+
+    challenge_id = request.args.get("challengeId", type=int)
+    status = (request.args.get("status") or "OPEN").upper()
+
+    challenge = Challenge.query.filter_by(id=challenge_id, user_id=user_id).first()
+    if not challenge:
+        return jsonify({"orders": []})
+
+    query = RestingOrder.query.filter_by(challenge_id=challenge.id)
+    if status != "ALL":
+        query = query.filter_by(status=status)
+    orders = query.order_by(RestingOrder.created_at.desc()).limit(200).all()
+
+    return jsonify({"orders": [_serialize_order(order) for order in orders]})
+
+
+@trade_bp.route("/orders/<int:order_id>", methods=["DELETE"])
+@jwt_required()
+def delete_order(order_id):
+    user_id = _get_current_user_id()
+    if not user_id:
+        return jsonify({"message": "Unauthorized"}), 401
+
+    order = (
+        RestingOrder.query.join(Challenge, Challenge.id == RestingOrder.challenge_id)
+        .filter(RestingOrder.id == order_id, Challenge.user_id == user_id)
+        .first()
+    )
+    if not order:
+        return jsonify({"message": "Order not found."}), 404
+
+    if not cancel_order(order.id):
+        return jsonify({"message": "Order is no longer open."}), 409
+
+    return jsonify({"message": "Order cancelled."})
+
+
 @trade_bp.route("/portfolio", methods=["GET"])
 @jwt_required()
 def get_portfolio():
@@ -222,49 +401,10 @@ def get_portfolio():
     if not challenge:
         return jsonify({"positions": [], "cashBalance": 0})
 
-    positions = Position.query.filter_by(challenge_id=challenge.id).all()
-    
-    # Find USD position (Cash)
-    usd_pos = next((p for p in positions if p.symbol == "USD"), None)
-
-    # Calculate Total Equity (Binance-style)
-    # Total = USD_Qty + Sum(Asset_Qty * Asset_Current_Price)
-    
-    asset_positions = [p for p in positions if p.symbol != "USD"]
-    
-    total_asset_value = 0.0
-    payload = []
-    
-    for pos in asset_positions:
-        # Fetch live price for total equity calculation
-        current_price = get_live_price(pos.symbol)
-        if current_price == 0:
-            current_price = pos.avg_price # Fallback to avg price if fetch fails
-            
-        market_value = pos.quantity * current_price
-        total_asset_value += market_value
-        
-        payload.append({
-            "symbol": pos.symbol,
-            "quantity": pos.quantity,
-            "avgPrice": pos.avg_price,
-            "marketValue": market_value, 
-            "currentPrice": current_price
-        })
-
-    # Determine Cash Balance
-    if usd_pos:
-        cash_balance = usd_pos.quantity
-    else:
-        # Legacy fallback: current_balance holds the Cash amount
-        # For legacy users without a USD position, current_balance is their available cash.
-        cash_balance = challenge.current_balance
+    snapshot = PortfolioSnapshot.query.filter_by(challenge_id=challenge.id).first()
+    if snapshot is None:
+        # Challenges that have not traded since snapshots were introduced
+        snapshot = load_snapshot(challenge)
+        db.session.commit()
 
-    total_equity = cash_balance + total_asset_value
-
-    return jsonify({
-        "positions": payload, 
-        "cashBalance": cash_balance,
-        "totalEquity": total_equity,
-        "challengeId": challenge.id
-    })
+    return jsonify(serialize_snapshot(snapshot))
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+# Challenge rules per plan. The first three thresholds are copied onto each Challenge
+# row when it is created, so a challenge keeps the terms it was sold with; the other
+# rules are read from here at evaluation time. None disables a rule.
+#
+#   profit_target_pct      equity gain over the starting balance that passes the challenge
+#   max_daily_loss_pct     loss from start-of-day equity, as % of the starting balance
+#   max_total_loss_pct     loss from the starting balance
+#   min_trading_days       days with at least one fill before the challenge can pass
+#   max_position_pct       largest single position as % of equity (checked on buys)
+#   consistency_pct        best day's gain as % of total profit the pass may not exceed
+#   trailing_drawdown_pct  loss from the equity high-water mark, as % of the starting balance
+DEFAULT_RULES = {
+    "profit_target_pct": 10.0,
+    "max_daily_loss_pct": 5.0,
+    "max_total_loss_pct": 10.0,
+    "min_trading_days": None,
+    "max_position_pct": None,
+    "consistency_pct": None,
+    "trailing_drawdown_pct": None,
+}
+
+RULE_SETS = {
+    "Starter": {},
+    "Pro": {},
+    "Elite": {"profit_target_pct": 8.0, "max_daily_loss_pct": 4.0},
+}
+
+
+class CompiledRuleSet:
+    """
+    A rule set turned into a list of array predicates. Disabled rules are left out at
+    compile time, so evaluate() only pays for the rules a plan actually uses.
+
+    evaluate() takes a dict of equal-length arrays (one entry per challenge):
+    starting, equity, day_start, peak_equity, profit_target_pct, max_daily_loss_pct,
+    max_total_loss_pct, trading_days and best_day_pnl, and returns the status per
+    challenge: "FAILED", "SUCCESSFUL" or "ACTIVE".
+    """
+
+    def __init__(self, name: str, rules: dict):
+        self.name = name
+        self.rules = rules
+        self.failures = [
+            # Per-row thresholds: the terms stored on the challenge
+            lambda c: np.maximum(c["day_start"] - c["equity"], 0.0) / c["starting"] * 100.0
+            >= c["max_daily_loss_pct"],
+            lambda c: np.maximum(c["starting"] - c["equity"], 0.0) / c["starting"] * 100.0
+            >= c["max_total_loss_pct"],
+        ]
+        self.pass_gates = []
+
+        trailing = rules["trailing_drawdown_pct"]
+        if trailing is not None:
+            self.failures.append(
+                lambda c: (np.maximum(c["peak_equity"], c["equity"]) - c["equity"]) / c["starting"] * 100.0
+                >= trailing
+            )
+
+        min_days = rules["min_trading_days"]
+        if min_days:
+            self.pass_gates.append(lambda c: c["trading_days"] >= min_days)
+
+        consistency = rules["consistency_pct"]
+        if consistency is not None:
+            def _consistent(c):
+                profit = c["equity"] - c["starting"]
+                best_day = np.maximum(c["best_day_pnl"], c["equity"] - c["day_start"])
+                return best_day <= profit * consistency / 100.0
+
+            self.pass_gates.append(_consistent)
+
+    def challenge_columns(self) -> dict:
+        """
+        Threshold columns for a new Challenge row.
+        """
+        return {
+            "profit_target": self.rules["profit_target_pct"],
+            "max_daily_loss_pct": self.rules["max_daily_loss_pct"],
+            "max_total_loss_pct": self.rules["max_total_loss_pct"],
+        }
+
+    def evaluate(self, columns: dict) -> np.ndarray:
+        failed = np.zeros(len(columns["equity"]), dtype=bool)
+        for rule in self.failures:
+            failed |= rule(columns)
+
+        profit_pct = (columns["equity"] - columns["starting"]) / columns["starting"] * 100.0
+        passed = ~failed & (profit_pct >= columns["profit_target_pct"])
+        for gate in self.pass_gates:
+            passed &= gate(columns)
+
+        return np.select([failed, passed], ["FAILED", "SUCCESSFUL"], default="ACTIVE")
+
+
+_compiled = {}
+
+
+def rule_set_for(plan_name) -> CompiledRuleSet:
+    """
+    Compiled rule set of a plan (unknown plans get the defaults), compiled on first use.
+    """
+    name = plan_name if plan_name in RULE_SETS else None
+    compiled = _compiled.get(name)
+    if compiled is None:
+        compiled = CompiledRuleSet(name or "default", {**DEFAULT_RULES, **RULE_SETS.get(name, {})})
+        _compiled[name] = compiled
+    return compiled
+
+
+def evaluate(plan_names, columns: dict) -> np.ndarray:
+    """
+    Evaluates challenges of mixed plans: each plan's compiled rule set runs once over
+    the rows of that plan.
+    """
+    plan_names = np.asarray(plan_names, dtype=object)
+    outcomes = np.full(len(plan_names), "ACTIVE", dtype=object)
+    for plan in set(plan_names.tolist()):
+        mask = plan_names == plan
+        subset = {key: np.asarray(values)[mask] for key, values in columns.items()}
+        outcomes[mask] = rule_set_for(plan).evaluate(subset)
+    return outcomes
@@ -0,0 +1,81 @@
+import time
+import zlib
+
+import numpy as np
+
+from app import candle_store
+
+
+# Bars generated behind the first live price of the day (~8 hours of 1m bars)
+HISTORY_BARS = 500
+VOLATILITY = 0.001  # per 1m bar
+
+
+def generate(symbol: str, anchor_price: float, end_ts: int, bars: int = HISTORY_BARS) -> list[dict]:
+    """
+    Builds `bars` 1m candles ending at end_ts whose last close is anchor_price.
+
+    The random walk is seeded from (symbol, UTC trading day), so the same day always
+    produces the same history, and is computed backwards from the anchor with one
+    cumulative product.
+    """
+    day = time.strftime("%Y-%m-%d", time.gmtime(end_ts))
+    rng = np.random.default_rng(zlib.crc32(f"{symbol}:{day}".encode()))
+
+    # Index 0 is the newest bar; each bar's open is the previous bar's close
+    moves = (rng.random(bars) - 0.5) * VOLATILITY
+    opens = anchor_price / np.cumprod(1 + moves)
+    closes = np.concatenate(([anchor_price], opens[:-1]))
+    highs = np.maximum(opens, closes) * (1 + rng.random(bars) * VOLATILITY * 0.5)
+    lows = np.minimum(opens, closes) * (1 - rng.random(bars) * VOLATILITY * 0.5)
+
+    end_bar = end_ts - end_ts % 60
+    times = end_bar - np.arange(bars, dtype=np.int64) * 60
+
+    ohlc = np.round(np.column_stack((opens, highs, lows, closes)), 2)[::-1].tolist()
+    return [
+        {
+            "symbol": symbol,
+            "interval": "1m",
+            "ts": bar_ts,
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": 0.0,
+        }
+        for bar_ts, (open_, high, low, close) in zip(times[::-1].tolist(), ohlc)
+    ]
+
+
+def ensure_history(symbol: str, anchor_price: float) -> None:
+    """
+    Makes sure a symbol has at least HISTORY_BARS bars. An empty series gets a synthetic
+    history ending now; a shorter stored series is backfilled with synthetic bars ending
+    just before its first bar (anchored at that bar's open). Stored bars, including real
+    scraped ticks from previous days, are never replaced.
+    """
+    now = int(time.time())
+    first = candle_store.first_bar(symbol, "1m")
+    if first is None:
+        candle_store.write_rows(symbol, "1m", generate(symbol, anchor_price, now))
+        return
+    first_ts, first_open, stored = first
+    if stored >= HISTORY_BARS:
+        return
+    candle_store.insert_rows(generate(symbol, first_open, first_ts - 60, bars=HISTORY_BARS - stored))
+
+
+def record_live_prices(poller) -> None:
+    """
+    Poller job: appends the latest scraped quote of each Moroccan symbol to its series.
+    """
+    from app.quote_cache import quote_cache
+    from app.routes.market import MOROCCAN_SYMBOLS
+
+    for symbol in MOROCCAN_SYMBOLS:
+        entry = quote_cache.get(symbol)
+        if not entry:
+            continue
+        ensure_history(symbol, entry["price"])
+        candle_store.record_tick(symbol, entry["price"], entry["fetched_at"])
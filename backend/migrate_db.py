@@ -18,6 +18,32 @@ def migrate():
         print("Added last_equity_update")
     except Exception as e:
         print(f"Error adding last_equity_update: {e}")
+
+    try:
+        c.execute("ALTER TABLE challenge ADD COLUMN day_realized_pnl REAL NOT NULL DEFAULT 0")
+        print("Added day_realized_pnl")
+    except Exception as e:
+        print(f"Error adding day_realized_pnl: {e}")
+
+    for column, ddl in [
+        ("trading_days", "INTEGER NOT NULL DEFAULT 0"),
+        ("last_trade_day", "DATE"),
+        ("best_day_pnl", "REAL NOT NULL DEFAULT 0"),
+        ("equity_high_water_mark", "REAL"),
+        ("max_drawdown_pct", "REAL NOT NULL DEFAULT 0"),
+    ]:
+        try:
+            c.execute(f"ALTER TABLE challenge ADD COLUMN {column} {ddl}")
+            print(f"Added {column}")
+        except Exception as e:
+            print(f"Error adding {column}: {e}")
+
+    try:
+        c.execute("ALTER TABLE payment ADD COLUMN provider_order_id VARCHAR(64)")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_payment_provider_order_id ON payment (provider_order_id)")
+        print("Added provider_order_id")
+    except Exception as e:
+        print(f"Error adding provider_order_id: {e}")
         
     conn.commit()
     conn.close()
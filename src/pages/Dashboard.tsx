@@ -87,26 +87,6 @@ const Dashboard = () => {
   const quoteCurrency = marketScope === "national" ? "MAD" : "USD";
   const [paperState, setPaperState] = useState<PaperTradingState | null>(null);
 
-  const persistChallengeBalance = useCallback(
-    (balance: number) => {
-      if (!challenge.id) return;
-      const token = typeof window !== "undefined" ? window.localStorage.getItem("ts_token") : null;
-      if (!token) return;
-      fetch(`${API_BASE}/api/challenge/update_balance`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          Authorization: `Bearer ${token}`,
-        },
-        body: JSON.stringify({
-          challengeId: challenge.id,
-          currentBalance: balance, // Backend currently expects this field name for balance update
-        }),
-      }).catch(() => {});
-    },
-    [challenge.id]
-  );
-
   // Auth Check & User Load
   useEffect(() => {
     const token = typeof window !== "undefined" ? window.localStorage.getItem("ts_token") : null;
@@ -310,6 +290,7 @@ const Dashboard = () => {
 
       const { equity } = computePaperEquity(paperState, simplePrices);
       
+      // Display only: the server marks equity to market and enforces the rules itself
       setChallenge(prev => {
             if (prev.id !== challenge.id) return prev;
             const pnl = equity - prev.yesterdayEquity;
@@ -320,10 +301,7 @@ const Dashboard = () => {
                 todayPnL: pnl
             };
         });
-      
-      persistChallengeBalance(equity);
-      
-  }, [prices, paperState, challenge.id, persistChallengeBalance]);
+  }, [prices, paperState, challenge.id]);
 
   const handleExecuteTrade = async (
     type: "BUY" | "SELL",
@@ -372,9 +350,17 @@ const Dashboard = () => {
           }
 
           const data = await res.json();
+          if (res.status === 202) {
+              // Not marketable yet: the order rests on the server until its price is reached
+              toast({
+                  title: "Order Placed",
+                  description: `${orderType} ${type} ${quantity} ${selectedTicker} is working`
+              });
+              return;
+          }
           toast({
               title: "Order Executed",
-              description: `${type} ${quantity} ${selectedTicker} @ $${price}`
+              description: `${type} ${quantity} ${selectedTicker} @ $${data.fillPrice ?? price}`
           });
 
           // Refresh Portfolio